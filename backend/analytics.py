@@ -1,16 +1,16 @@
-import pandas as pd
-import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-import joblib
 from datetime import datetime
+from typing import TYPE_CHECKING
+
+# pandas, scikit-learn and joblib are imported on first use, importing this module stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
 
 class TrafficPredictor:
     def __init__(self):
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+        self.model = None
         self.is_trained = False
 
-    def train_model(self, data: pd.DataFrame):
+    def train_model(self, data: "pd.DataFrame"):
         """
         Trenuje model na podstawie danych historycznych.
         Oczekuje kolumn: 'hour', 'day_of_week', 'is_holiday', 'traffic_level'
@@ -19,9 +19,12 @@ class TrafficPredictor:
             print("Brak danych do trenowania.")
             return
 
+        from sklearn.ensemble import RandomForestRegressor
+
         X = data[['hour', 'day_of_week', 'is_holiday']]
         y = data['traffic_level']
         
+        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
         self.model.fit(X, y)
         self.is_trained = True
         print("Model wytrenowany pomyślnie.")
@@ -45,9 +48,11 @@ class TrafficPredictor:
         return max(0.0, min(1.0, prediction[0]))
 
     def save_model(self, path="traffic_model.pkl"):
+        import joblib
         joblib.dump(self.model, path)
 
     def load_model(self, path="traffic_model.pkl"):
+        import joblib
         try:
             self.model = joblib.load(path)
             self.is_trained = True
@@ -1,3 +1,4 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -8,6 +9,7 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import models
 import database
+import metrics
 
 # Security configuration
 SECRET_KEY = "your-secret-key-change-this-in-production-09f26e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
@@ -24,7 +26,8 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against a hashed password."""
     # return pwd_context.verify(plain_password, hashed_password)
     try:
-        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+        with metrics.AUTH_PASSWORD_DURATION.time(operation="verify"):
+            return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
     except Exception as e:
         print(f"Error verifying password: {e}")
         return False
@@ -32,7 +35,8 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     """Hash a password."""
     # return pwd_context.hash(password)
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    with metrics.AUTH_PASSWORD_DURATION.time(operation="hash"):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
@@ -56,11 +60,25 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
+            metrics.AUTH_EVENTS.inc(event="token", result="invalid")
             raise credentials_exception
     except JWTError:
+        metrics.AUTH_EVENTS.inc(event="token", result="invalid")
         raise credentials_exception
     
     user = db.query(models.User).filter(models.User.email == email).first()
     if user is None:
+        metrics.AUTH_EVENTS.inc(event="token", result="unknown_user")
         raise credentials_exception
+    metrics.AUTH_EVENTS.inc(event="token", result="ok")
     return user
+
+def get_current_admin(current_user: models.User = Depends(get_current_user)):
+    """Allow only users whose email is listed in ADMIN_EMAILS (comma-separated)."""
+    admins = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+    if current_user.email.lower() not in admins:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator privileges required",
+        )
+    return current_user
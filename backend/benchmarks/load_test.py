@@ -0,0 +1,239 @@
+"""
+Concurrent load test of the API against SQLite and a local TomTom stand-in.
+
+Starts the mock TomTom server and the FastAPI app (uvicorn, in-process) and
+drives a weighted mix of traffic, transit and CRUD requests from concurrent
+clients. Reports throughput and p50/p95/p99 latency per endpoint.
+
+Usage (from the backend/ directory):
+    python -m benchmarks.load_test --duration 30 --concurrency 20 --latency-ms 80 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from benchmarks.mock_tomtom import MockTomTomConfig, start_mock_server
+from benchmarks.results import load_previous, print_comparison, save_results
+from benchmarks.workload import make_route
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p * len(sorted_values) / 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.latencies[label].append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors[label] += 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        report = {}
+        for label, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            report[label] = {
+                "requests": len(values),
+                "errors": self.errors[label],
+                "rps": len(values) / elapsed,
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+                "mean": statistics.fmean(values),
+            }
+        return report
+
+
+async def traffic_flow(client, recorder, user, rng):
+    await recorder.call(client, "POST /traffic/flow", "POST", "/traffic/flow", json=make_route(rng))
+
+
+async def traffic_flow_simulated(client, recorder, user, rng):
+    simulation_time = (datetime.now() + timedelta(days=1)).replace(hour=rng.randint(6, 20)).isoformat()
+    await recorder.call(client, "POST /traffic/flow (simulation)", "POST", "/traffic/flow",
+                        params={"simulation_time": simulation_time}, json=make_route(rng))
+
+
+async def transit_plan(client, recorder, user, rng):
+    await recorder.call(client, "POST /transit/plan", "POST", "/transit/plan",
+                        json={"from_stop_id": "1001", "to_stop_id": "1002"})
+
+
+async def list_routes(client, recorder, user, rng):
+    await recorder.call(client, "GET /routes/", "GET", "/routes/", headers=user["headers"])
+
+
+async def route_crud(client, recorder, user, rng):
+    route = make_route(rng, points=120)
+    payload = {
+        "name": f"Trasa {rng.randint(1, 10000)}",
+        "origin": "Rynek", "destination": "Politechnika",
+        "origin_lat": route[0][1], "origin_lon": route[0][0],
+        "dest_lat": route[-1][1], "dest_lon": route[-1][0],
+        "geometry_json": json.dumps(route),
+        "transport_mode": rng.choice(["car", "bike", "walk"]),
+    }
+    response = await recorder.call(client, "POST /routes/", "POST", "/routes/", json=payload, headers=user["headers"])
+    if response is None or response.status_code != 200:
+        return
+    route_id = response.json()["id"]
+    await recorder.call(client, "PUT /routes/{id}", "PUT", f"/routes/{route_id}",
+                        json={"name": "Zmieniona"}, headers=user["headers"])
+    await recorder.call(client, "DELETE /routes/{id}", "DELETE", f"/routes/{route_id}", headers=user["headers"])
+
+
+async def pins(client, recorder, user, rng):
+    payload = {"name": "Pinezka", "lat": 50.04 + rng.uniform(-0.02, 0.02), "lon": 22.0 + rng.uniform(-0.02, 0.02)}
+    await recorder.call(client, "POST /pins/", "POST", "/pins/", json=payload, headers=user["headers"])
+    await recorder.call(client, "GET /pins/", "GET", "/pins/", headers=user["headers"])
+
+
+async def login(client, recorder, user, rng):
+    await recorder.call(client, "POST /auth/login", "POST", "/auth/login",
+                        data={"username": user["email"], "password": user["password"]})
+
+
+SCENARIOS = {
+    "traffic_flow": (traffic_flow, 30),
+    "traffic_flow_simulated": (traffic_flow_simulated, 15),
+    "transit_plan": (transit_plan, 10),
+    "list_routes": (list_routes, 20),
+    "route_crud": (route_crud, 10),
+    "pins": (pins, 10),
+    "login": (login, 5),
+}
+
+
+async def create_users(client, count: int) -> list:
+    users = []
+    for i in range(count):
+        email, password = f"bench{i}@example.com", "benchmark-password"
+        await client.post("/auth/register", json={"email": email, "username": f"bench{i}", "password": password})
+        response = await client.post("/auth/login", data={"username": email, "password": password})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        users.append({"email": email, "password": password, "headers": {"Authorization": f"Bearer {token}"}})
+    return users
+
+
+async def drive(base_url: str, scenarios: list, concurrency: int, duration: float, seed: int) -> tuple:
+    import httpx
+
+    recorder = Recorder()
+    functions = [SCENARIOS[name][0] for name in scenarios]
+    weights = [SCENARIOS[name][1] for name in scenarios]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        users = await create_users(client, min(concurrency, 10))
+        deadline = time.perf_counter() + duration
+
+        async def worker(worker_id: int):
+            rng = random.Random(seed + worker_id)
+            user = users[worker_id % len(users)]
+            while time.perf_counter() < deadline:
+                scenario = rng.choices(functions, weights)[0]
+                await scenario(client, recorder, user, rng)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return recorder, elapsed
+
+
+def start_api(port: int):
+    import uvicorn
+
+    app = importlib.import_module("main").app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="api", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mock TomTom latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of failing TomTom calls")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of scenarios")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+
+    mock_config = MockTomTomConfig(args.latency_ms, args.jitter_ms, args.error_rate)
+    mock = start_mock_server(mock_config)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the app modules are imported
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'load.db')}"
+        os.environ["TOMTOM_API_KEY"] = "benchmark"
+        os.environ["TOMTOM_BASE_URL"] = f"http://127.0.0.1:{mock.server_address[1]}"
+        # Measure the request path itself, not the quota or background refreshes
+        os.environ.setdefault("TOMTOM_DAILY_BUDGET", "0")
+        os.environ.setdefault("PREFETCH_ENABLED", "0")
+
+        port = free_port()
+        server = start_api(port)
+        # Schema creation runs in the lifespan warmup
+        import database, models
+        models.Base.metadata.create_all(bind=database.engine)
+
+        recorder, elapsed = asyncio.run(drive(f"http://127.0.0.1:{port}", scenarios, args.concurrency,
+                                              args.duration, args.seed))
+        server.should_exit = True
+        mock.shutdown()
+
+    report = recorder.summary(elapsed)
+    total = sum(entry["requests"] for entry in report.values())
+    print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s), "
+          f"mock TomTom: {mock_config.requests} calls, {mock_config.errors} failed\n")
+    print(f"{'endpoint':<34}{'reqs':>7}{'errs':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for label, entry in report.items():
+        print(f"{label:<34}{entry['requests']:>7}{entry['errors']:>6}{entry['rps']:>8.1f}"
+              f"{entry['p50']:>9.1f}{entry['p95']:>9.1f}{entry['p99']:>9.1f}")
+
+    previous = load_previous("load")
+    if previous:
+        print("\nCompared with previous run (ms):")
+        print_comparison(report, previous, metrics=("p50", "p95", "p99"))
+    print(f"\nSaved to {save_results('load', report)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmarks of the traffic hot path.
+
+Covers sample_coordinates, interpolate_traffic_segments, get_simulated_traffic,
+estimate_travel_time and TrafficPredictor.predict_traffic (heuristic, plus the trained model when
+pandas and scikit-learn are installed). Times are per call in microseconds.
+
+Usage (from the backend/ directory):
+    python -m benchmarks.micro_benchmarks [--repeat 5] [--points 300]
+"""
+import argparse
+import random
+import statistics
+import timeit
+from datetime import datetime
+
+from benchmarks.results import load_previous, print_comparison, save_results
+from benchmarks.workload import make_route
+
+
+def measure(func, repeat: int, target_seconds: float = 0.2) -> dict:
+    """Run func in batches sized to take about target_seconds and report µs per call."""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * target_seconds / max(elapsed, 1e-9)))
+    samples = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(samples), "min": min(samples), "max": max(samples), "calls": number}
+
+
+def trained_predictor():
+    try:
+        import pandas as pd
+    except ImportError:
+        return None
+    from analytics import TrafficPredictor
+
+    rng = random.Random(0)
+    rows = [
+        {"hour": h, "day_of_week": d, "is_holiday": 0,
+         "traffic_level": min(1.0, (0.8 if h in (7, 8, 16, 17) else 0.3) + rng.uniform(-0.1, 0.1))}
+        for d in range(7) for h in range(24) for _ in range(3)
+    ]
+    predictor = TrafficPredictor()
+    predictor.train_model(pd.DataFrame(rows))
+    return predictor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--points", type=int, default=300, help="Route length in coordinates")
+    args = parser.parse_args()
+
+    import traffic_model
+    import traffic_service
+    from analytics import TrafficPredictor
+
+    rng = random.Random(42)
+    route = make_route(rng, points=args.points)
+    rush_hour = datetime(2026, 3, 3, 8, 0)
+    traffic_points = traffic_service.get_simulated_traffic(route, rush_hour)
+
+    cases = {
+        f"sample_coordinates[{args.points}]": lambda: traffic_service.sample_coordinates(route, max_points=20),
+        f"interpolate_traffic_segments[{args.points}]":
+            lambda: traffic_service.interpolate_traffic_segments(route, traffic_points),
+        f"get_simulated_traffic[{args.points}]": lambda: traffic_service.get_simulated_traffic(route, rush_hour),
+        f"estimate_travel_time[{args.points}]": lambda: traffic_model.estimate_travel_time(route, traffic_points),
+        "predict_traffic[heuristic]": lambda: TrafficPredictor().predict_traffic(rush_hour),
+    }
+    predictor = trained_predictor()
+    if predictor is not None:
+        cases["predict_traffic[random_forest]"] = lambda: predictor.predict_traffic(rush_hour)
+    else:
+        print("pandas/scikit-learn not installed, skipping predict_traffic[random_forest]")
+
+    results = {name: measure(func, args.repeat) for name, func in cases.items()}
+    print("Microseconds per call:")
+    print_comparison(results, load_previous("micro"), metrics=("median",))
+    print(f"Saved to {save_results('micro', results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Local stand-in for the TomTom flowSegmentData API.
+
+Answers GET /traffic/services/4/flowSegmentData/absolute/{zoom}/json with a
+response shaped like TomTom's, after a configurable latency, and fails a
+configurable share of requests.
+
+Usage (from the backend/ directory):
+    python -m benchmarks.mock_tomtom --port 8081 --latency-ms 80 --jitter-ms 40 --error-rate 0.05
+Then start the API with TOMTOM_BASE_URL=http://127.0.0.1:8081 TOMTOM_API_KEY=bench.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FLOW_PATH_PREFIX = "/traffic/services/4/flowSegmentData/absolute/"
+
+
+class MockTomTomConfig:
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 20.0, error_rate: float = 0.0,
+                 error_status: int = 503):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+
+def flow_segment_response(lat: float, lon: float) -> dict:
+    """Speeds derived from the point, so the same point always gets the same answer."""
+    rng = random.Random(f"{lat:.4f},{lon:.4f}")
+    free_flow_speed = rng.choice([30, 50, 50, 70, 90])
+    current_speed = round(free_flow_speed * rng.uniform(0.3, 1.0))
+    return {
+        "flowSegmentData": {
+            "frc": "FRC2",
+            "currentSpeed": current_speed,
+            "freeFlowSpeed": free_flow_speed,
+            "currentTravelTime": 60,
+            "freeFlowTravelTime": 45,
+            "confidence": round(rng.uniform(0.7, 1.0), 2),
+            "roadClosure": False,
+            "coordinates": {"coordinate": [{"latitude": lat, "longitude": lon}]},
+        }
+    }
+
+
+def make_handler(config: MockTomTomConfig):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status_code: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.startswith(FLOW_PATH_PREFIX):
+                self._send(404, {"error": "Not found"})
+                return
+
+            delay_ms = max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms))
+            time.sleep(delay_ms / 1000)
+
+            with config.lock:
+                config.requests += 1
+                failed = random.random() < config.error_rate
+                if failed:
+                    config.errors += 1
+            if failed:
+                self._send(config.error_status, {"error": "Simulated upstream failure"})
+                return
+
+            params = parse_qs(url.query)
+            try:
+                lat, lon = (float(v) for v in params["point"][0].split(","))
+            except (KeyError, ValueError):
+                self._send(400, {"error": "Invalid point"})
+                return
+            self._send(200, flow_segment_response(lat, lon))
+
+    return Handler
+
+
+class MockServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections under concurrent load
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def start_mock_server(config: MockTomTomConfig, port: int = 0) -> ThreadingHTTPServer:
+    """Start the mock in a daemon thread. Use port 0 to pick a free port."""
+    server = MockServer(("127.0.0.1", port), make_handler(config))
+    threading.Thread(target=server.serve_forever, name="mock-tomtom", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    config = MockTomTomConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status)
+    server = start_mock_server(config, args.port)
+    print(f"Mock TomTom listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import json
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def save_results(name: str, results: Dict) -> str:
+    """Store a benchmark run as results/<name>-<timestamp>.json and return its path."""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(RESULTS_DIR, f"{name}-{timestamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"name": name, "timestamp": timestamp, "results": results}, f, indent=2, default=str)
+    return path
+
+
+def load_previous(name: str) -> Optional[Dict]:
+    """Load the most recent stored run of a benchmark, if any."""
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    runs = sorted(f for f in os.listdir(RESULTS_DIR) if f.startswith(f"{name}-") and f.endswith(".json"))
+    if not runs:
+        return None
+    with open(os.path.join(RESULTS_DIR, runs[-1]), encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def print_comparison(current: Dict, previous: Optional[Dict], metrics=("median",)):
+    """Print each metric next to the previous run with the relative change."""
+    for key, values in current.items():
+        for metric in metrics:
+            value = values.get(metric)
+            if value is None:
+                continue
+            line = f"{key:<40} {metric:>6}: {value:10.3f}"
+            old = (previous or {}).get(key, {}).get(metric)
+            if old:
+                change = (value - old) / old * 100
+                line += f"   (previous {old:.3f}, {change:+.1f}%)"
+            print(line)
@@ -0,0 +1,89 @@
+"""
+Startup-time benchmark: module import, first request and time to readiness.
+
+Every run starts a fresh interpreter, so nothing is cached between samples.
+The app runs against a throwaway SQLite database.
+
+Usage (from the backend/ directory):
+    python -m benchmarks.startup_benchmark [--runs 5] [--ready-timeout 30]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.results import load_previous, print_comparison, save_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    request_started = time.perf_counter()
+    client.get("/health")
+    first_request = time.perf_counter()
+    ready_ms = None
+    while time.perf_counter() - started < {ready_timeout}:
+        if client.get("/ready").status_code == 200:
+            ready_ms = (time.perf_counter() - started) * 1000
+            break
+        time.sleep(0.01)
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (first_request - request_started) * 1000,
+    "ready_ms": ready_ms,
+}}))
+"""
+
+
+def run_once(ready_timeout: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(ready_timeout=ready_timeout)],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        wall_ms = (time.perf_counter() - started) * 1000
+    sample = json.loads(output.strip().splitlines()[-1])
+    sample["process_ms"] = wall_ms
+    return sample
+
+
+def summarize(samples: list) -> dict:
+    summary = {}
+    for key in ("import_ms", "first_request_ms", "ready_ms", "process_ms"):
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        if values:
+            summary[key] = {
+                "median": statistics.median(values),
+                "min": min(values),
+                "max": max(values),
+                "samples": len(values),
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ready-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    samples = [run_once(args.ready_timeout) for _ in range(args.runs)]
+    summary = summarize(samples)
+    previous = load_previous("startup")
+    print_comparison(summary, previous, metrics=("median", "max"))
+    print(f"Saved to {save_results('startup', summary)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import math
+import random
+from typing import List
+
+# Rzeszów city centre and a few typical trip endpoints around it (lat, lon)
+RZESZOW_CENTER = (50.0413, 21.9990)
+RZESZOW_PLACES = [
+    (50.0375, 22.0048),  # Rynek
+    (50.0197, 21.9869),  # Politechnika
+    (50.0563, 21.9851),  # Baranówka
+    (50.0295, 22.0182),  # Podkarpacka
+    (50.0702, 22.0212),  # Zaczernie direction
+    (50.0107, 21.9612),  # Przybyszówka
+    (50.0483, 22.0351),  # Słocina
+]
+
+
+def make_route(rng: random.Random, points: int = 300) -> List[List[float]]:
+    """
+    A plausible road-like route between two places as [lon, lat] pairs,
+    the format the frontend sends to /traffic/flow.
+    """
+    (lat1, lon1), (lat2, lon2) = rng.sample(RZESZOW_PLACES, 2)
+    # Bend the route through a midpoint so it is not a straight line
+    mid_lat = (lat1 + lat2) / 2 + rng.uniform(-0.008, 0.008)
+    mid_lon = (lon1 + lon2) / 2 + rng.uniform(-0.008, 0.008)
+    coords = []
+    for i in range(points):
+        t = i / (points - 1)
+        lat = (1 - t) ** 2 * lat1 + 2 * (1 - t) * t * mid_lat + t ** 2 * lat2
+        lon = (1 - t) ** 2 * lon1 + 2 * (1 - t) * t * mid_lon + t ** 2 * lon2
+        wiggle = 0.0002 * math.sin(t * 40)
+        coords.append([round(lon + wiggle, 6), round(lat, 6)])
+    return coords
@@ -1,14 +1,20 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
 import os
 
-# Use SQLite for development if POSTGRES_URL is not set
-# SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./trafficwatch.db")
-SQLALCHEMY_DATABASE_URL = "mysql+pymysql://root:@localhost/mapy"
+load_dotenv()
 
+# Set DATABASE_URL to use another database, e.g. "sqlite:///./trafficwatch.db" for development
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "mysql+pymysql://root:@localhost/mapy")
+
+# Creating the engine does not connect, the first connection is made on first use
+connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL,
+    connect_args=connect_args,
+    pool_pre_ping=True
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
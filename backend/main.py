@@ -1,24 +1,97 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import models, schemas, database, auth
 import traffic_service
-import gtfs_service
+import traffic_model
+import shape_simplify
+import startup
+import metrics
+import prefetch
+import road_graph
+import traffic_tiles
+import traffic_subscriptions
+import asyncio
+import profiling
+import time
+from transit_feed import ShapeNotSupported, transit_feed, encode_json
+from traffic_cache import cell_key
 
 load_dotenv()
 
-models.Base.metadata.create_all(bind=database.engine)
+metrics.instrument_engine(database.engine)
 
-app = FastAPI(title="TrafficWatch API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the schema and warm up GTFS, model and caches without blocking boot."""
+    stop_warmup = startup.start_warmup()
+    prefetch_task = None
+    if prefetch.PREFETCH_ENABLED:
+        await asyncio.to_thread(prefetch.corridor_stats.load, prefetch.PREFETCH_STATE_PATH)
+        prefetch_task = asyncio.create_task(prefetch.scheduler.run())
+    live_traffic_task = asyncio.create_task(traffic_subscriptions.hub.run())
+    yield
+    stop_warmup.set()
+    live_traffic_task.cancel()
+    await asyncio.gather(live_traffic_task, return_exceptions=True)
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+        await asyncio.gather(prefetch_task, return_exceptions=True)
+        await asyncio.to_thread(prefetch.corridor_stats.save, prefetch.PREFETCH_STATE_PATH)
+
+app = FastAPI(title="TrafficWatch API", version="0.1.0", lifespan=lifespan)
 
 @app.get("/health")
 def health_check():
     return {"status": "ok", "timestamp": datetime.now()}
 
+@app.get("/ready")
+def readiness_check():
+    """Report whether every subsystem has finished warming up (503 until then)."""
+    report = startup.readiness.report()
+    status_code = status.HTTP_200_OK if report["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(content=jsonable_encoder(report), status_code=status_code)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request by route template; profile it when asked with 'X-Profile: 1'."""
+    profiler = None
+    if profiling.wants_profile(request.headers):
+        profiler = profiling.SamplingProfiler()
+        profiler.start()
+
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status_code,
+        )
+        if profiler is not None:
+            profiler.stop()
+
+    if profiler is not None:
+        response.headers["X-Profile-File"] = profiler.save(f"{request.method} {request.url.path}")
+    return response
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text-format metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -65,6 +138,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     """Login user and return JWT token."""
     user = db.query(models.User).filter(models.User.email == form_data.username).first()
     if not user:
+        metrics.AUTH_EVENTS.inc(event="login", result="unknown_user")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -72,6 +146,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         )
     
     if not auth.verify_password(form_data.password, user.hashed_password):
+        metrics.AUTH_EVENTS.inc(event="login", result="bad_password")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -82,6 +157,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     access_token = auth.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
     )
+    metrics.AUTH_EVENTS.inc(event="login", result="ok")
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/auth/me")
@@ -217,6 +293,8 @@ async def get_traffic_flow(coordinates: List[List[float]], simulation_time: Opti
     """
     Get traffic flow data for route coordinates.
     Returns color-coded segments based on real-time traffic or simulation.
+    Live data is bounded by a latency budget; each traffic point reports its
+    provenance (tomtom, cache, history or simulation) in 'source'.
     
     Args:
         coordinates: List of [lon, lat] points
@@ -230,50 +308,305 @@ async def get_traffic_flow(coordinates: List[List[float]], simulation_time: Opti
             time_diff = abs((simulation_time - current_time).total_seconds())
             if time_diff > 900:
                 use_simulation = True
+                metrics.SIMULATION_FALLBACKS.inc(reason="requested_time")
         
         traffic_points = []
         
         if not use_simulation:
+            prefetch.corridor_stats.record_open(coordinates)
             try:
-                traffic_points = await traffic_service.get_traffic_flow_segments(coordinates)
+                with metrics.TRAFFIC_STAGE_DURATION.time(stage="upstream"):
+                    traffic_points = await traffic_service.get_traffic_flow_segments(coordinates)
                 if not traffic_points:
                     use_simulation = True
+                    metrics.SIMULATION_FALLBACKS.inc(reason="empty_response")
             except Exception as e:
                 print(f"TomTom API error: {e}")
+                traffic_points = []
                 use_simulation = True
+                metrics.SIMULATION_FALLBACKS.inc(reason="upstream_error")
 
         if use_simulation:
             sim_time = simulation_time if simulation_time else current_time
-            traffic_points = traffic_service.get_simulated_traffic(coordinates, sim_time)
+            with metrics.TRAFFIC_STAGE_DURATION.time(stage="simulation"):
+                traffic_points = traffic_service.get_simulated_traffic(coordinates, sim_time)
 
-        traffic_segments = traffic_service.interpolate_traffic_segments(coordinates, traffic_points)
+        source, provenance = summarize_provenance(traffic_points, use_simulation)
+
+        with metrics.TRAFFIC_STAGE_DURATION.time(stage="interpolate"):
+            traffic_segments = traffic_service.interpolate_traffic_segments(coordinates, traffic_points)
         
-        return {
-            "segments": traffic_segments,
-            "trafficPoints": traffic_points,
-            "source": "simulation" if use_simulation else "tomtom"
-        }
+        with metrics.TRAFFIC_STAGE_DURATION.time(stage="serialize"):
+            body = encode_json({
+                "segments": traffic_segments,
+                "trafficPoints": traffic_points,
+                "source": source,
+                "provenance": provenance,
+                "circuitBreaker": traffic_service.tomtom_breaker.state
+            })
+        return Response(content=body, media_type="application/json")
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         print(f"Error fetching traffic: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch traffic data")
 
+def summarize_provenance(traffic_points: List[dict], use_simulation: bool = False):
+    """Overall source (simulation, tomtom or mixed) and per-source point counts."""
+    provenance = {}
+    for point in traffic_points:
+        provenance[point["source"]] = provenance.get(point["source"], 0) + 1
+    if use_simulation or set(provenance) == {"simulation"}:
+        source = "simulation"
+    elif set(provenance) <= {"tomtom", "cache"}:
+        source = "tomtom"
+    else:
+        source = "mixed"
+    return source, provenance
+
+MAX_ETA_ROUTES = 10
+# Points fetched live per ETA request, as many as one /traffic/flow call
+ETA_LIVE_POINTS = 20
+
+@app.post("/traffic/eta")
+async def get_traffic_eta(request: schemas.TrafficEtaRequest):
+    """
+    Traffic-aware travel time for one or more alternative routes.
+    Segment lengths come from the route geometry and each segment is timed
+    with the speed of its nearest traffic point (live, cached or simulated).
+
+    Args:
+        request: Routes as lists of [lon, lat] points, optional departure time
+            (simulation when more than 15 minutes away) and whether to return
+            per-segment times
+
+    Returns:
+        Per-route distance, duration, free-flow duration and delay, and the
+        index of the fastest route
+    """
+    routes = request.routes
+    if not routes or len(routes) > MAX_ETA_ROUTES:
+        raise HTTPException(status_code=400, detail=f"Provide between 1 and {MAX_ETA_ROUTES} routes")
+    if any(len(route) < 2 or any(len(coord) < 2 for coord in route) for route in routes):
+        raise HTTPException(status_code=400, detail="Each route needs at least two [lon, lat] points")
+
+    try:
+        use_simulation = False
+        current_time = datetime.now()
+        if request.departure_time:
+            departure_time = request.departure_time.replace(tzinfo=None)
+            if abs((departure_time - current_time).total_seconds()) > 900:
+                use_simulation = True
+                metrics.SIMULATION_FALLBACKS.inc(reason="requested_time")
+
+        if use_simulation:
+            with metrics.TRAFFIC_STAGE_DURATION.time(stage="simulation"):
+                route_points = [traffic_service.get_simulated_traffic(route, departure_time) for route in routes]
+        else:
+            # Alternatives share their ends, so each cell is fetched once for all of them
+            sampled = [traffic_service.sample_coordinates(route, max_points=20) for route in routes]
+            unique = {}
+            shared_by = {}
+            for coords in sampled:
+                for key in {cell_key(coord[1], coord[0]) for coord in coords}:
+                    shared_by[key] = shared_by.get(key, 0) + 1
+                for coord in coords:
+                    unique.setdefault(cell_key(coord[1], coord[0]), coord)
+            # One request gets the same upstream share as /traffic/flow, spent on the
+            # cells most routes pass through; the rest come from cache, history or simulation
+            points = sorted(unique.items(), key=lambda item: -shared_by[item[0]])
+            with metrics.TRAFFIC_STAGE_DURATION.time(stage="upstream"):
+                fetched = await traffic_service.get_traffic_flow_segments(
+                    [coord for _, coord in points], max_points=len(points), live_limit=ETA_LIVE_POINTS)
+            by_cell = {cell_key(point["lat"], point["lon"]): point for point in fetched}
+            route_points = [[by_cell[cell_key(coord[1], coord[0])] for coord in coords] for coords in sampled]
+
+        results = []
+        with metrics.TRAFFIC_STAGE_DURATION.time(stage="eta"):
+            for index, (route, points) in enumerate(zip(routes, route_points)):
+                eta = traffic_model.estimate_travel_time(route, points, request.include_segments)
+                eta["index"] = index
+                eta["source"], eta["provenance"] = summarize_provenance(points, use_simulation)
+                results.append(eta)
+
+        fastest = min(results, key=lambda eta: eta["duration"])["index"]
+        body = encode_json({
+            "routes": results,
+            "fastest": fastest,
+            "circuitBreaker": traffic_service.tomtom_breaker.state
+        })
+        return Response(content=body, media_type="application/json")
+    except Exception as e:
+        print(f"Error estimating travel time: {e}")
+        raise HTTPException(status_code=500, detail="Failed to estimate travel time")
+
+@app.get("/traffic/tiles/{z}/{x}/{y}")
+async def get_traffic_tile(z: int, x: int, y: int, request: Request):
+    """
+    GeoJSON tile of road segments colored by current traffic, for a city-wide overlay.
+    Tiles are rebuilt only where observations changed and carry an ETag,
+    so unchanged tiles are answered with 304.
+    """
+    if not 0 <= z <= traffic_tiles.MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+    body, etag = await asyncio.to_thread(traffic_tiles.traffic_tiles.get, z, x, y)
+    headers = {"ETag": etag, "Cache-Control": traffic_tiles.CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/geo+json", headers=headers)
+
+@app.websocket("/traffic/live")
+async def live_traffic(websocket: WebSocket):
+    """
+    Live traffic for watched routes.
+
+    Send {"action": "subscribe", "coordinates": [[lon, lat], ...]} to get a
+    'subscribed' message with the color of every sampled segment, then
+    'update' messages with only the segments whose color changed.
+    {"action": "unsubscribe", "subscription": id} stops a subscription.
+    """
+    await websocket.accept()
+    connection = traffic_subscriptions.Connection()
+    sender = asyncio.create_task(connection.pump(websocket.send_json, websocket.close))
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                connection.send({"type": "error", "detail": "Invalid JSON"})
+                continue
+            try:
+                reply = traffic_subscriptions.hub.handle(connection, message)
+            except Exception as e:
+                # A malformed message must not drop the socket and the client's other subscriptions
+                print(f"Error handling live traffic message: {e}")
+                reply = {"type": "error", "detail": "Invalid message"}
+            connection.send(reply)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        traffic_subscriptions.hub.disconnect(connection)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
+@app.get("/traffic/live/status")
+def get_live_traffic_status():
+    """Get the number of watched cells, subscriptions and connected clients"""
+    return traffic_subscriptions.hub.status()
+
+def require_transit_feed():
+    """Answer 503 while the GTFS feed is still warming up instead of loading it on the request path."""
+    if transit_feed.current is None:
+        raise HTTPException(status_code=503, detail="Transit feed is still loading")
+
+def set_feed_headers(response: Response, feed_version):
+    """Expose the GTFS feed version so clients and caches can key on it."""
+    response.headers["ETag"] = feed_version.etag
+    response.headers["X-Feed-Version"] = feed_version.version
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def cached_json_response(request: Request, feed_version, body: bytes, variant: Optional[str] = None) -> Response:
+    """Serve pre-encoded JSON for a feed version, answering 304 when the client is up to date."""
+    etag = feed_version.etag
+    if variant:
+        etag = f'{etag[:-1]}-{variant}"'
+    headers = {
+        "ETag": etag,
+        "X-Feed-Version": feed_version.version,
+        "Cache-Control": "no-cache",
+    }
+    if etag_matches(request, etag):
+        metrics.record_cache("transit_http_etag", hit=True)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    metrics.record_cache("transit_http_etag", hit=False)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/transit/stops")
-async def get_bus_stops():
+async def get_bus_stops(request: Request):
     """Get all bus stops in Rzeszów"""
+    require_transit_feed()
     try:
-        stops = gtfs_service.gtfs_service.get_all_stops()
-        return {"stops": stops, "count": len(stops)}
+        with transit_feed.acquire() as feed:
+            return cached_json_response(request, feed, feed.stops_json())
     except Exception as e:
         print(f"Error fetching bus stops: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch bus stops")
 
+@app.get("/transit/stops/nearest")
+async def get_nearest_stops(
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=50),
+    max_distance: Optional[float] = Query(None, gt=0, description="Maximum distance in metres")
+):
+    """Get the k bus stops closest to a point, with distances in metres"""
+    require_transit_feed()
+    try:
+        with transit_feed.acquire() as feed:
+            stops = feed.stop_index().nearest(lat, lon, k=k, max_distance=max_distance)
+            set_feed_headers(response, feed)
+        return {"stops": stops, "count": len(stops)}
+    except Exception as e:
+        print(f"Error fetching nearest stops: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch nearest stops")
+
+@app.get("/transit/stops/nearby")
+async def get_stops_nearby(
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(500, gt=0, le=5000, description="Search radius in metres"),
+    limit: Optional[int] = Query(None, ge=1)
+):
+    """Get all bus stops within a radius of a point, nearest first"""
+    require_transit_feed()
+    try:
+        with transit_feed.acquire() as feed:
+            stops = feed.stop_index().within(lat, lon, radius, limit=limit)
+            set_feed_headers(response, feed)
+        return {"stops": stops, "count": len(stops)}
+    except Exception as e:
+        print(f"Error fetching nearby stops: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch nearby stops")
+
+@app.post("/transit/stops/near-route")
+async def get_stops_near_route(
+    coordinates: List[List[float]],
+    response: Response,
+    radius: float = Query(300, gt=0, le=2000, description="Maximum distance from the route in metres"),
+    limit: Optional[int] = Query(None, ge=1)
+):
+    """
+    Get bus stops within walking distance of a route.
+    
+    Args:
+        coordinates: List of [lon, lat] points
+    """
+    require_transit_feed()
+    try:
+        with transit_feed.acquire() as feed:
+            stops = feed.stop_index().near_route(coordinates, radius, limit=limit)
+            set_feed_headers(response, feed)
+        return {"stops": stops, "count": len(stops)}
+    except Exception as e:
+        print(f"Error fetching stops near route: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch stops near route")
+
 @app.get("/transit/stops/{stop_id}")
-async def get_stop_details(stop_id: str):
+async def get_stop_details(stop_id: str, response: Response):
     """Get details for a specific bus stop including routes that serve it"""
+    require_transit_feed()
     try:
-        stop = gtfs_service.gtfs_service.get_stop_by_id(stop_id)
+        with transit_feed.acquire() as feed:
+            stop = feed.service.get_stop_by_id(stop_id)
+            set_feed_headers(response, feed)
         if not stop:
             raise HTTPException(status_code=404, detail="Stop not found")
         return stop
@@ -284,17 +617,18 @@ async def get_stop_details(stop_id: str):
         raise HTTPException(status_code=500, detail="Failed to fetch stop details")
 
 @app.get("/transit/routes")
-async def get_transit_routes():
+async def get_transit_routes(request: Request):
     """Get all transit routes/lines"""
+    require_transit_feed()
     try:
-        routes = gtfs_service.gtfs_service.get_all_routes()
-        return {"routes": routes, "count": len(routes)}
+        with transit_feed.acquire() as feed:
+            return cached_json_response(request, feed, feed.routes_json())
     except Exception as e:
         print(f"Error fetching routes: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch routes")
 
 @app.post("/transit/plan")
-async def plan_transit_route(request: schemas.TransitPlanRequest):
+async def plan_transit_route(request: schemas.TransitPlanRequest, response: Response):
     """
     Find transit connections between two stops
     
@@ -304,27 +638,90 @@ async def plan_transit_route(request: schemas.TransitPlanRequest):
     Returns:
         List of possible connections with route details
     """
+    require_transit_feed()
     try:
-        connections = gtfs_service.gtfs_service.find_connections(
-            request.from_stop_id, 
-            request.to_stop_id, 
-            request.departure_time
-        )
+        with transit_feed.acquire() as feed:
+            connections = feed.service.find_connections(
+                request.from_stop_id, 
+                request.to_stop_id, 
+                request.departure_time
+            )
+            set_feed_headers(response, feed)
         return {"connections": connections, "count": len(connections)}
     except Exception as e:
         print(f"Error planning transit route: {e}")
         raise HTTPException(status_code=500, detail="Failed to plan transit route")
 
 @app.get("/transit/routes/{route_id}/shape")
-async def get_route_shape(route_id: str):
-    """Get the geographic path and stops for a specific route/line"""
+async def get_route_shape(
+    route_id: str,
+    request: Request,
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="Map zoom level the shape is drawn at"),
+    tolerance: Optional[float] = Query(None, ge=0, description="Allowed simplification error in metres"),
+    encoding: Literal["json", "polyline"] = "json"
+):
+    """
+    Get the geographic path and stops for a specific route/line.
+    The path is simplified for the given zoom level or tolerance (full geometry by default)
+    and can be returned as an encoded polyline.
+    """
+    if tolerance is None and zoom is not None:
+        tolerance = shape_simplify.tolerance_for_zoom(zoom)
+    require_transit_feed()
     try:
-        shape = gtfs_service.gtfs_service.get_route_shape(route_id)
-        if not shape:
-            raise HTTPException(status_code=404, detail="Route not found")
-        return shape
+        with transit_feed.acquire() as feed:
+            shape = feed.route_shape_json(route_id, tolerance or 0.0, encoding)
+            if shape is None:
+                raise HTTPException(status_code=404, detail="Route not found")
+            body, level = shape
+            return cached_json_response(request, feed, body, variant=f"{route_id}-{level:g}-{encoding}")
     except HTTPException:
         raise
+    except ShapeNotSupported as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error fetching route shape: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch route shape")
+
+@app.get("/transit/feed")
+async def get_transit_feed_status(response: Response):
+    """Get the active GTFS feed version and reload status"""
+    feed_status = transit_feed.status()
+    if transit_feed.current:
+        set_feed_headers(response, transit_feed.current)
+    return feed_status
+
+@app.post("/transit/feed/reload", status_code=status.HTTP_202_ACCEPTED)
+async def reload_transit_feed(current_user: models.User = Depends(auth.get_current_admin)):
+    """
+    Reload the GTFS feed in the background (protected - administrators listed in ADMIN_EMAILS only).
+    Requests already running finish against the previous version.
+    """
+    started = transit_feed.reload_in_background()
+    return {"reloading": True, "started": started, "version": transit_feed.status()["version"]}
+
+@app.get("/routing/route")
+async def get_road_route(
+    from_lat: float,
+    from_lon: float,
+    to_lat: float,
+    to_lon: float,
+    mode: Literal["car", "bike", "walk"] = "car",
+):
+    """
+    Fastest route from the local road graph, weighted by current traffic for cars.
+    The response follows the OSRM route format; geometry coordinates are
+    [lon, lat] pairs as stored in Route.geometry_json and sent to /traffic/flow.
+    """
+    if road_graph.router.graph is None:
+        raise HTTPException(status_code=503, detail="Road graph not loaded")
+    with metrics.ROUTING_QUERY_DURATION.time(mode=mode):
+        route = await asyncio.to_thread(road_graph.router.route, from_lat, from_lon, to_lat, to_lon, mode)
+    if route is None:
+        raise HTTPException(status_code=404, detail="No route between these points")
+    return {"code": "Ok", "routes": [route]}
+
+@app.get("/routing/status")
+def get_routing_status():
+    """Get the loaded road graph size and source"""
+    return road_graph.router.status()
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+import metrics
+import traffic_service
+from rate_limit import PRIORITY_PREFETCH, BackgroundBudget, prefetch_budget
+from traffic_cache import cell_key, observation_cache
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_INTERVAL_SECONDS = float(os.getenv("PREFETCH_INTERVAL_SECONDS", "60"))
+# How far ahead of demand corridors are warmed
+PREFETCH_LEAD_MINUTES = float(os.getenv("PREFETCH_LEAD_MINUTES", "15"))
+# Minimum decayed number of opens in an hour-of-week slot before a corridor is prefetched
+PREFETCH_MIN_SCORE = float(os.getenv("PREFETCH_MIN_SCORE", "1.5"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+PREFETCH_STATE_PATH = os.getenv("PREFETCH_STATE_PATH", "prefetch_state.json")
+
+HOURS_PER_WEEK = 7 * 24
+# Popularity halves every two weeks so changed habits take over
+HALF_LIFE_SECONDS = 14 * 24 * 3600
+MAX_CORRIDORS = 2000
+# Corridors dropped at once when the table is full
+EVICTION_BATCH = 200
+
+
+def hour_of_week(moment: datetime) -> int:
+    return moment.weekday() * 24 + moment.hour
+
+
+class Corridor:
+    def __init__(self, corridor_id: str, points: List[Tuple[float, float]]):
+        self.id = corridor_id
+        self.points = points
+        self.scores = [0.0] * HOURS_PER_WEEK
+        # Sum of scores, kept alongside them so eviction need not decay every corridor
+        self.total = 0.0
+        self.updated_at = time.time()
+
+    def decay(self, now: float):
+        factor = 0.5 ** ((now - self.updated_at) / HALF_LIFE_SECONDS)
+        if factor < 1.0:
+            self.scores = [score * factor for score in self.scores]
+            self.total *= factor
+        self.updated_at = now
+
+    def decayed_total(self, now: float) -> float:
+        return self.total * 0.5 ** ((now - self.updated_at) / HALF_LIFE_SECONDS)
+
+
+class CorridorStats:
+    """
+    Learns which corridors are opened at which hour of the week.
+
+    A corridor is the list of points /traffic/flow samples from a route, so
+    the same saved route opened again maps to the same corridor and to the
+    same cached observations.
+    """
+
+    def __init__(self):
+        self.corridors: Dict[str, Corridor] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def corridor_points(coordinates: List[List[float]]) -> List[Tuple[float, float]]:
+        sampled = traffic_service.sample_coordinates(coordinates, max_points=20)
+        return [(coord[1], coord[0]) for coord in sampled]
+
+    @staticmethod
+    def corridor_id(points: List[Tuple[float, float]]) -> str:
+        cells = ";".join(f"{lat},{lon}" for lat, lon in (cell_key(lat, lon) for lat, lon in points))
+        return hashlib.sha1(cells.encode("utf-8")).hexdigest()[:16]
+
+    def record_open(self, coordinates: List[List[float]], when: Optional[datetime] = None, weight: float = 1.0):
+        if not coordinates:
+            return
+        points = self.corridor_points(coordinates)
+        corridor_id = self.corridor_id(points)
+        now = time.time()
+        with self._lock:
+            corridor = self.corridors.get(corridor_id)
+            if corridor is None:
+                corridor = self.corridors[corridor_id] = Corridor(corridor_id, points)
+            corridor.decay(now)
+            corridor.scores[hour_of_week(when or datetime.now())] += weight
+            corridor.total += weight
+            if len(self.corridors) > MAX_CORRIDORS:
+                self._evict(now, keep=corridor_id)
+
+    def _evict(self, now: float, keep: str):
+        """Drop the coldest corridors in one batch, so the next new ones do not each pay for a scan."""
+        target = MAX_CORRIDORS - EVICTION_BATCH
+        candidates = (c for c in self.corridors.values() if c.id != keep)
+        for corridor in heapq.nsmallest(len(self.corridors) - target, candidates,
+                                        key=lambda c: c.decayed_total(now)):
+            del self.corridors[corridor.id]
+
+    def popular(self, moment: datetime, lead: timedelta, min_score: float) -> List[Tuple[float, Corridor]]:
+        """Corridors expected in demand between now and now + lead, most popular first."""
+        slots = {hour_of_week(moment), hour_of_week(moment + lead)}
+        now = time.time()
+        result = []
+        with self._lock:
+            for corridor in self.corridors.values():
+                corridor.decay(now)
+                score = max(corridor.scores[slot] for slot in slots)
+                if score >= min_score:
+                    result.append((score, corridor))
+        result.sort(key=lambda item: item[0], reverse=True)
+        return result
+
+    def save(self, path: str):
+        with self._lock:
+            state = [
+                {"id": c.id, "points": c.points, "scores": c.scores, "updated_at": c.updated_at}
+                for c in self.corridors.values()
+            ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load prefetch state: {e}")
+            return
+        with self._lock:
+            for entry in state:
+                corridor = Corridor(entry["id"], [tuple(point) for point in entry["points"]])
+                corridor.scores = entry["scores"]
+                corridor.total = sum(corridor.scores)
+                corridor.updated_at = entry["updated_at"]
+                self.corridors[corridor.id] = corridor
+
+
+class PrefetchScheduler:
+    """
+    Periodically refreshes the traffic of corridors that are about to be
+    opened, so that warm opens are served entirely from the cache.
+
+    Each round queues the stale points of popular corridors in a priority
+    queue (most popular first) and drains it within the prefetch budget
+    (PREFETCH_DAILY_BUDGET), which also stays above the interactive reserve
+    of the shared TomTom budget. Prefetching pauses while interactive requests are
+    calling TomTom.
+    """
+
+    def __init__(self, stats: CorridorStats, budget: BackgroundBudget):
+        self.stats = stats
+        self.budget = budget
+        self.rounds = 0
+        self._sequence = itertools.count()
+
+    def _stale(self, lat: float, lon: float) -> bool:
+        # Refresh anything that would expire before the next round
+        max_age = max(0.0, observation_cache.fresh_ttl - PREFETCH_INTERVAL_SECONDS)
+        return observation_cache.get(lat, lon, max_age) is None
+
+    def build_queue(self, moment: datetime) -> asyncio.PriorityQueue:
+        queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        queued = set()
+        for score, corridor in self.stats.popular(moment, timedelta(minutes=PREFETCH_LEAD_MINUTES),
+                                                  PREFETCH_MIN_SCORE):
+            for lat, lon in corridor.points:
+                key = cell_key(lat, lon)
+                if key in queued or not self._stale(lat, lon):
+                    continue
+                queued.add(key)
+                queue.put_nowait((-score, next(self._sequence), lat, lon))
+        return queue
+
+    async def _worker(self, queue: asyncio.PriorityQueue, client: httpx.AsyncClient, semaphore: asyncio.Semaphore):
+        while not queue.empty():
+            _, _, lat, lon = queue.get_nowait()
+            while traffic_service.interactive_in_flight > 0:
+                await asyncio.sleep(0.05)
+            if not self._stale(lat, lon):
+                metrics.PREFETCH_POINTS.inc(result="already_fresh")
+                continue
+            if not self.budget.try_acquire(PRIORITY_PREFETCH):
+                metrics.PREFETCH_POINTS.inc(result="budget")
+                # Out of prefetch budget for this round, the rest waits for the next one
+                while not queue.empty():
+                    queue.get_nowait()
+                return
+            if not traffic_service.tomtom_breaker.allow():
+                self.budget.refund()
+                metrics.PREFETCH_POINTS.inc(result="circuit_open")
+                continue
+            point = await traffic_service.fetch_flow_point(client, semaphore, 0, lat, lon, 10)
+            metrics.PREFETCH_POINTS.inc(result="refreshed" if point else "failed")
+
+    async def run_once(self, moment: Optional[datetime] = None):
+        queue = self.build_queue(moment or datetime.now())
+        if queue.empty():
+            return
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        async with httpx.AsyncClient(timeout=traffic_service.TOMTOM_CALL_TIMEOUT_SECONDS) as client:
+            await asyncio.gather(*(self._worker(queue, client, semaphore) for _ in range(PREFETCH_CONCURRENCY)))
+
+    async def run(self):
+        """Scheduler loop, started from the application lifespan."""
+        while True:
+            await asyncio.sleep(PREFETCH_INTERVAL_SECONDS)
+            if not traffic_service.TOMTOM_API_KEY:
+                continue
+            try:
+                await self.run_once()
+                self.rounds += 1
+                # Persist what was learned every ~10 rounds
+                if self.rounds % 10 == 0:
+                    await asyncio.to_thread(self.stats.save, PREFETCH_STATE_PATH)
+            except Exception as e:
+                print(f"Prefetch round failed: {e}")
+
+
+corridor_stats = CorridorStats()
+scheduler = PrefetchScheduler(corridor_stats, prefetch_budget)
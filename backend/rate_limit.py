@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+# Global TomTom quota, shared by interactive and prefetch calls.
+# Opt-in: the default 0 means unlimited, so user requests are never refused unless a quota is set.
+TOMTOM_DAILY_BUDGET = float(os.getenv("TOMTOM_DAILY_BUDGET", "0"))
+TOMTOM_BURST = float(os.getenv("TOMTOM_BURST", "100"))
+# Share of the bucket only interactive requests may use
+INTERACTIVE_RESERVE = float(os.getenv("TOMTOM_INTERACTIVE_RESERVE", "0.5"))
+# Prefetch's own cap, which applies even when the global quota is unlimited (0 = unlimited)
+PREFETCH_DAILY_BUDGET = float(os.getenv("PREFETCH_DAILY_BUDGET", "1000"))
+PREFETCH_BURST = float(os.getenv("PREFETCH_BURST", "40"))
+# Own cap of the live traffic poller (0 = unlimited); it never spends the interactive reserve either way
+LIVE_TRAFFIC_DAILY_BUDGET = float(os.getenv("LIVE_TRAFFIC_DAILY_BUDGET", "0"))
+LIVE_TRAFFIC_BURST = float(os.getenv("LIVE_TRAFFIC_BURST", "100"))
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_PREFETCH = "prefetch"
+
+
+class TokenBucket:
+    """
+    Token bucket limiting upstream calls to a daily budget.
+
+    Interactive calls may drain the bucket completely; prefetch calls stop
+    while the bucket is below the interactive reserve, so background work
+    never spends the budget users need.
+    """
+
+    def __init__(self, daily_budget: float, capacity: float, interactive_reserve: float):
+        self.unlimited = daily_budget <= 0
+        self.rate = daily_budget / 86400.0
+        self.capacity = capacity
+        self.reserve = capacity * interactive_reserve
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, priority: str = PRIORITY_INTERACTIVE) -> bool:
+        if self.unlimited:
+            return True
+        with self._lock:
+            self._refill()
+            floor = self.reserve if priority == PRIORITY_PREFETCH else 0.0
+            if self.tokens - 1 < floor:
+                return False
+            self.tokens -= 1
+            return True
+
+    def refund(self):
+        """Return a token taken for a call that was not made."""
+        if self.unlimited:
+            return
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def available(self) -> float:
+        if self.unlimited:
+            return float("inf")
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+
+tomtom_budget = TokenBucket(TOMTOM_DAILY_BUDGET, TOMTOM_BURST, INTERACTIVE_RESERVE)
+
+
+class BackgroundBudget:
+    """
+    Budget of a background consumer: its own bucket, drawn from the shared
+    bucket above the interactive reserve. Tokens are taken from both or
+    neither.
+    """
+
+    def __init__(self, own: TokenBucket, shared: TokenBucket):
+        self.own = own
+        self.shared = shared
+
+    def try_acquire(self, priority: str = PRIORITY_PREFETCH) -> bool:
+        if not self.own.try_acquire(priority):
+            return False
+        if not self.shared.try_acquire(PRIORITY_PREFETCH):
+            self.own.refund()
+            return False
+        return True
+
+    def refund(self):
+        self.own.refund()
+        self.shared.refund()
+
+    def available(self) -> float:
+        """Calls that can be made now without touching the interactive reserve."""
+        shared = self.shared.available()
+        if not self.shared.unlimited:
+            shared -= self.shared.reserve
+        return min(self.own.available(), shared)
+
+
+prefetch_budget = BackgroundBudget(TokenBucket(PREFETCH_DAILY_BUDGET, PREFETCH_BURST, 0.0), tomtom_budget)
+live_traffic_budget = BackgroundBudget(TokenBucket(LIVE_TRAFFIC_DAILY_BUDGET, LIVE_TRAFFIC_BURST, 0.0),
+                                       tomtom_budget)
@@ -0,0 +1,562 @@
+import bz2
+import gzip
+import heapq
+import json
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ROAD_GRAPH_OSM_PATH = os.getenv("ROAD_GRAPH_OSM_PATH", "rzeszow.osm")
+ROAD_GRAPH_CACHE_DIR = os.getenv("ROAD_GRAPH_CACHE_DIR", "road_graph_cache")
+# Bump when the cached array layout changes
+CACHE_FORMAT = 1
+
+EARTH_RADIUS_M = 6371008.8
+
+MODE_BITS = {"car": 1, "bike": 2, "walk": 4}
+# Same city averages the frontend uses for bike and walk times
+BIKE_SPEED_KMH = 15.0
+WALK_SPEED_KMH = 5.0
+
+# Default car speeds (km/h) by highway class when the way has no usable maxspeed
+CAR_SPEEDS = {
+    "motorway": 120, "motorway_link": 60,
+    "trunk": 90, "trunk_link": 50,
+    "primary": 60, "primary_link": 40,
+    "secondary": 50, "secondary_link": 40,
+    "tertiary": 50, "tertiary_link": 30,
+    "unclassified": 40, "residential": 30,
+    "living_street": 10, "service": 15,
+}
+NO_BIKE_OR_WALK = {"motorway", "motorway_link", "trunk", "trunk_link"}
+BIKE_ONLY = {"cycleway"}
+WALK_ONLY = {"footway", "pedestrian", "steps", "corridor"}
+BIKE_AND_WALK = {"path", "track", "bridleway"}
+ALLOWED_VALUES = {"yes", "designated", "permissive", "destination"}
+MAXSPEED_ZONES = {"PL:urban": 50, "PL:rural": 90, "PL:living_street": 20, "PL:motorway": 140, "PL:expressway": 120}
+
+# Observed speed ratio never scales an edge by more than this
+MIN_TRAFFIC_FACTOR = 0.1
+TRAFFIC_EXPIRY_SWEEP_SECONDS = 60.0
+CELL_SCALE = 1000  # matches traffic_cache.CELL_PRECISION = 3
+
+
+def _open_osm(path: str):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _parse_maxspeed(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    if value in MAXSPEED_ZONES:
+        return float(MAXSPEED_ZONES[value])
+    number = value.split()[0].split(";")[0]
+    try:
+        speed = float(number)
+    except ValueError:
+        return None
+    return speed * 1.609 if "mph" in value else speed
+
+
+def way_access(tags: Dict[str, str]) -> Tuple[int, int, float]:
+    """
+    Modes allowed along and against the way direction, and the car speed.
+
+    Returns:
+        (forward mode bits, backward mode bits, car speed in km/h)
+    """
+    highway = tags.get("highway")
+    if highway is None or tags.get("area") == "yes":
+        return 0, 0, 0.0
+
+    modes = 0
+    if highway in CAR_SPEEDS:
+        modes |= MODE_BITS["car"]
+    if highway in CAR_SPEEDS and highway not in NO_BIKE_OR_WALK:
+        modes |= MODE_BITS["bike"] | MODE_BITS["walk"]
+    if highway in BIKE_ONLY:
+        modes |= MODE_BITS["bike"]
+    if highway in WALK_ONLY:
+        modes |= MODE_BITS["walk"]
+    if highway in BIKE_AND_WALK:
+        modes |= MODE_BITS["bike"] | MODE_BITS["walk"]
+
+    if tags.get("access") in ("no", "private"):
+        modes = 0
+    for mode, keys in (("car", ("motor_vehicle", "motorcar")), ("bike", ("bicycle",)), ("walk", ("foot",))):
+        for key in keys:
+            value = tags.get(key)
+            if value in ("no", "private", "use_sidepath"):
+                modes &= ~MODE_BITS[mode]
+            elif value in ALLOWED_VALUES and (mode != "car" or highway in CAR_SPEEDS):
+                modes |= MODE_BITS[mode]
+    if not modes:
+        return 0, 0, 0.0
+
+    forward = backward = modes
+    oneway = tags.get("oneway")
+    implied_oneway = tags.get("junction") in ("roundabout", "circular") or highway in ("motorway", "motorway_link")
+    one_way_modes = MODE_BITS["car"]
+    if tags.get("oneway:bicycle") != "no" and not tags.get("cycleway", "").startswith("opposite"):
+        one_way_modes |= MODE_BITS["bike"]
+    if oneway in ("yes", "true", "1") or (implied_oneway and oneway != "no"):
+        backward &= ~one_way_modes
+    elif oneway == "-1":
+        forward &= ~one_way_modes
+
+    speed = _parse_maxspeed(tags.get("maxspeed")) or CAR_SPEEDS.get(highway, 0.0)
+    return forward, backward, float(speed)
+
+
+def parse_osm(path: str) -> Dict[str, np.ndarray]:
+    """
+    Read an OSM XML extract into CSR adjacency arrays.
+
+    Every node of a routable way becomes a vertex, so route geometry follows
+    the roads exactly. Each way segment adds a directed edge per direction
+    some mode may travel.
+    """
+    coordinates: Dict[int, Tuple[float, float]] = {}
+    ways: List[Tuple[List[int], int, int, float]] = []
+
+    with _open_osm(path) as f:
+        node_refs: List[int] = []
+        tags: Dict[str, str] = {}
+        for event, element in ET.iterparse(f, events=("end",)):
+            tag = element.tag
+            if tag == "node":
+                coordinates[int(element.get("id"))] = (float(element.get("lat")), float(element.get("lon")))
+                # Node tags (traffic signals, shops...) must not leak into the next way
+                tags = {}
+                element.clear()
+            elif tag == "nd":
+                node_refs.append(int(element.get("ref")))
+            elif tag == "tag":
+                tags[element.get("k")] = element.get("v")
+            elif tag == "way":
+                forward, backward, speed = way_access(tags)
+                if (forward or backward) and len(node_refs) > 1:
+                    ways.append((node_refs, forward, backward, speed))
+                node_refs, tags = [], {}
+                element.clear()
+            elif tag == "relation":
+                node_refs, tags = [], {}
+                element.clear()
+
+    vertex_of: Dict[int, int] = {}
+    lats: List[float] = []
+    lons: List[float] = []
+    sources: List[int] = []
+    targets: List[int] = []
+    modes: List[int] = []
+    speeds: List[float] = []
+
+    def vertex(node_id: int) -> int:
+        index = vertex_of.get(node_id)
+        if index is None:
+            index = vertex_of[node_id] = len(lats)
+            lat, lon = coordinates[node_id]
+            lats.append(lat)
+            lons.append(lon)
+        return index
+
+    for node_refs, forward, backward, speed in ways:
+        refs = [ref for ref in node_refs if ref in coordinates]
+        for a, b in zip(refs, refs[1:]):
+            if a == b:
+                continue
+            u, v = vertex(a), vertex(b)
+            if forward:
+                sources.append(u)
+                targets.append(v)
+                modes.append(forward)
+                speeds.append(speed)
+            if backward:
+                sources.append(v)
+                targets.append(u)
+                modes.append(backward)
+                speeds.append(speed)
+
+    lat = np.array(lats, dtype=np.float64)
+    lon = np.array(lons, dtype=np.float64)
+    source = np.array(sources, dtype=np.int32)
+    target = np.array(targets, dtype=np.int32)
+
+    order = np.argsort(source, kind="stable")
+    source, target = source[order], target[order]
+    edge_modes = np.array(modes, dtype=np.uint8)[order]
+    edge_speeds = np.array(speeds, dtype=np.float32)[order]
+
+    lat1, lat2 = np.radians(lat[source]), np.radians(lat[target])
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin(np.radians(lon[target] - lon[source]) / 2) ** 2)
+    lengths = (2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).astype(np.float32)
+
+    vertex_count = len(lat)
+    offsets = np.zeros(vertex_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=vertex_count), out=offsets[1:])
+    rev_edges = np.argsort(target, kind="stable").astype(np.int32)
+    rev_offsets = np.zeros(vertex_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(target, minlength=vertex_count), out=rev_offsets[1:])
+
+    mid_cells = _cell_ids((lat[source] + lat[target]) / 2, (lon[source] + lon[target]) / 2)
+    cell_order = np.argsort(mid_cells, kind="stable").astype(np.int32)
+
+    return {
+        "lat": lat,
+        "lon": lon,
+        "offsets": offsets,
+        "sources": source,
+        "targets": target,
+        "lengths": lengths,
+        "speeds": edge_speeds,
+        "modes": edge_modes,
+        "rev_offsets": rev_offsets,
+        "rev_edges": rev_edges,
+        "edge_cells": mid_cells[cell_order],
+        "edge_cell_order": cell_order,
+    }
+
+
+def _cell_ids(lat, lon):
+    """Integer id of the ~100 m observation cell (traffic_cache.cell_key) of each point."""
+    lat_cells = np.round(np.asarray(lat) * CELL_SCALE).astype(np.int64) + 90 * CELL_SCALE
+    lon_cells = np.round(np.asarray(lon) * CELL_SCALE).astype(np.int64) + 180 * CELL_SCALE
+    return lat_cells * (360 * CELL_SCALE + 1) + lon_cells
+
+
+def _source_signature(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"source": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime, "format": CACHE_FORMAT}
+
+
+def save_arrays(arrays: Dict[str, np.ndarray], cache_dir: str, signature: Dict):
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(cache_dir, f"{name}.npy"), array)
+    # Written last, so an interrupted build is never mistaken for a valid cache
+    with open(os.path.join(cache_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(dict(signature, arrays=sorted(arrays)), f)
+
+
+def load_arrays(cache_dir: str) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Memory-map cached arrays; pages are read lazily as searches touch them."""
+    with open(os.path.join(cache_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r") for name in manifest["arrays"]}
+    return manifest, arrays
+
+
+class RoadGraph:
+    """
+    Directed road graph in CSR form with per-mode travel time weights.
+
+    Topology, lengths and speeds stay memory-mapped and read-only. Travel
+    times are kept in memory per mode; car times are rescaled in place from
+    traffic observations.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        # Plain ndarray views over the mapped files; np.memmap indexing is several times slower
+        arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        self.lat = arrays["lat"]
+        self.lon = arrays["lon"]
+        self.offsets = arrays["offsets"]
+        self.sources = arrays["sources"]
+        self.targets = arrays["targets"]
+        self.lengths = arrays["lengths"]
+        self.speeds = arrays["speeds"]
+        self.modes = arrays["modes"]
+        self.rev_offsets = arrays["rev_offsets"]
+        self.rev_edges = arrays["rev_edges"]
+        self.edge_cells = arrays["edge_cells"]
+        self.edge_cell_order = arrays["edge_cell_order"]
+
+        lengths = self.lengths.astype(np.float64)
+        speeds = self.speeds.astype(np.float64)
+        modes = self.modes
+        allowed = {mode: (modes & bit) != 0 for mode, bit in MODE_BITS.items()}
+        with np.errstate(divide="ignore"):
+            self.free_flow_car = np.where(allowed["car"] & (speeds > 0), lengths / (speeds / 3.6), np.inf)
+        self.weights = {
+            "car": self.free_flow_car.copy(),
+            "bike": np.where(allowed["bike"], lengths / (BIKE_SPEED_KMH / 3.6), np.inf),
+            "walk": np.where(allowed["walk"], lengths / (WALK_SPEED_KMH / 3.6), np.inf),
+        }
+        car_speeds = speeds[allowed["car"]]
+        self.max_speed = {
+            "car": float(car_speeds.max()) / 3.6 if len(car_speeds) else 1.0,
+            "bike": BIKE_SPEED_KMH / 3.6,
+            "walk": WALK_SPEED_KMH / 3.6,
+        }
+        self.traffic_observed_at = np.zeros(len(lengths))
+
+        node_modes = np.zeros(len(self.lat), dtype=np.uint8)
+        np.bitwise_or.at(node_modes, self.sources, modes)
+        np.bitwise_or.at(node_modes, self.targets, modes)
+        self.node_modes = node_modes
+
+        # Local metres (equirectangular) for snapping and the A* lower bound
+        self.lat0 = float(np.mean(self.lat)) if len(self.lat) else 0.0
+        self.cos_lat0 = math.cos(math.radians(self.lat0))
+        self.xs = np.radians(self.lon) * EARTH_RADIUS_M * self.cos_lat0
+        self.ys = np.radians(self.lat) * EARTH_RADIUS_M
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.lat)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def snap(self, lat: float, lon: float, mode: str) -> Tuple[int, float]:
+        """Nearest vertex reachable in the mode and its distance in metres."""
+        x = math.radians(lon) * EARTH_RADIUS_M * self.cos_lat0
+        y = math.radians(lat) * EARTH_RADIUS_M
+        candidates = np.flatnonzero(self.node_modes & MODE_BITS[mode])
+        if len(candidates) == 0:
+            return -1, math.inf
+        distances = (self.xs[candidates] - x) ** 2 + (self.ys[candidates] - y) ** 2
+        best = int(np.argmin(distances))
+        return int(candidates[best]), math.sqrt(float(distances[best]))
+
+    def edges_in_cell(self, lat: float, lon: float) -> np.ndarray:
+        cell = _cell_ids(lat, lon)
+        start, end = np.searchsorted(self.edge_cells, [cell, cell + 1])
+        return self.edge_cell_order[start:end]
+
+    def apply_speed_ratio(self, lat: float, lon: float, speed_ratio: float, observed_at: float) -> int:
+        """Scale car travel times of edges in the observation's cell; returns the number of edges updated."""
+        edges = self.edges_in_cell(lat, lon)
+        if len(edges):
+            factor = max(MIN_TRAFFIC_FACTOR, min(1.0, speed_ratio))
+            self.weights["car"][edges] = self.free_flow_car[edges] / factor
+            self.traffic_observed_at[edges] = observed_at
+        return len(edges)
+
+    def expire_traffic(self, observed_before: float):
+        stale = np.flatnonzero((self.traffic_observed_at > 0) & (self.traffic_observed_at < observed_before))
+        if len(stale):
+            self.weights["car"][stale] = self.free_flow_car[stale]
+            self.traffic_observed_at[stale] = 0
+
+    def shortest_path(self, source: int, target: int, mode: str) -> Optional[Tuple[float, List[int]]]:
+        """
+        Bidirectional A* with the average of the forward and backward
+        straight-line potentials, which keeps both searches consistent.
+
+        Returns:
+            (travel time in seconds, edge indices along the path), or None if unreachable
+        """
+        if source == target:
+            return 0.0, []
+
+        weights = self.weights[mode]
+        offsets, targets = self.offsets, self.targets
+        rev_offsets, rev_edges, sources = self.rev_offsets, self.rev_edges, self.sources
+        xs, ys = self.xs, self.ys
+        # Slightly under the top speed so projection error cannot overestimate
+        inverse_speed = 0.99 / self.max_speed[mode]
+        sx, sy = float(xs[source]), float(ys[source])
+        tx, ty = float(xs[target]), float(ys[target])
+        potentials: Dict[int, float] = {}
+
+        def potential(v: int) -> float:
+            p = potentials.get(v)
+            if p is None:
+                x, y = float(xs[v]), float(ys[v])
+                p = potentials[v] = (math.hypot(x - tx, y - ty) - math.hypot(x - sx, y - sy)) * inverse_speed / 2
+            return p
+
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({source: -1}, {target: -1})
+        settled = (set(), set())
+        heaps = ([(potential(source), source)], [(-potential(target), target)])
+        best, meeting = math.inf, -1
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            _, u = heapq.heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            g_u = dist[side][u]
+            own, other = dist[side], dist[1 - side]
+
+            if side == 0:
+                start, end = int(offsets[u]), int(offsets[u + 1])
+                edge_ids = range(start, end)
+                neighbours = targets[start:end].tolist()
+                edge_weights = weights[start:end].tolist()
+            else:
+                start, end = int(rev_offsets[u]), int(rev_offsets[u + 1])
+                edge_ids = rev_edges[start:end].tolist()
+                neighbours = sources[edge_ids].tolist()
+                edge_weights = weights[edge_ids].tolist()
+
+            sign = 1.0 if side == 0 else -1.0
+            for edge, v, w in zip(edge_ids, neighbours, edge_weights):
+                if w == math.inf:
+                    continue
+                g = g_u + w
+                if g < own.get(v, math.inf):
+                    own[v] = g
+                    parent[side][v] = edge
+                    heapq.heappush(heaps[side], (g + sign * potential(v), v))
+                    if v in other and g + other[v] < best:
+                        best, meeting = g + other[v], v
+
+        if meeting < 0:
+            return None
+
+        forward_edges = []
+        v = meeting
+        while parent[0][v] >= 0:
+            edge = parent[0][v]
+            forward_edges.append(edge)
+            v = int(sources[edge])
+        forward_edges.reverse()
+        v = meeting
+        while parent[1][v] >= 0:
+            edge = parent[1][v]
+            forward_edges.append(edge)
+            v = int(targets[edge])
+        return best, forward_edges
+
+
+class RoadRouter:
+    """
+    Local car/bike/walk routing over an OSM extract.
+
+    The extract is parsed once into CSR arrays cached as .npy files in
+    ROAD_GRAPH_CACHE_DIR; later starts memory-map the cache instead of
+    parsing. Car edge weights follow the traffic observation cache.
+    """
+
+    def __init__(self, osm_path: str = ROAD_GRAPH_OSM_PATH, cache_dir: str = ROAD_GRAPH_CACHE_DIR):
+        self.osm_path = osm_path
+        self.cache_dir = cache_dir
+        self.graph: Optional[RoadGraph] = None
+        self.loaded_at: Optional[float] = None
+        self.history_ttl = 3600.0
+        self._last_expiry = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable] = []
+
+    def _cache_is_current(self) -> bool:
+        manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return False
+        if not os.path.exists(self.osm_path):
+            # Shipped cache without the extract
+            return True
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        signature = _source_signature(self.osm_path)
+        return all(manifest.get(key) == value for key, value in signature.items())
+
+    def load(self) -> Optional[str]:
+        """
+        Load the graph, building the cache first when the extract changed.
+
+        Returns:
+            Reason when routing stays disabled, None once loaded
+        """
+        with self._lock:
+            if not self._cache_is_current():
+                if not os.path.exists(self.osm_path):
+                    return f"no OSM extract at {self.osm_path}"
+                started = time.perf_counter()
+                arrays = parse_osm(self.osm_path)
+                save_arrays(arrays, self.cache_dir, _source_signature(self.osm_path))
+                print(f"Built road graph from {self.osm_path} in {time.perf_counter() - started:.1f}s")
+            _, arrays = load_arrays(self.cache_dir)
+            self.graph = RoadGraph(arrays)
+            self.loaded_at = time.time()
+        return None
+
+    def attach_observations(self, cache):
+        """Apply every new traffic observation to car weights as it is stored."""
+        self.history_ttl = cache.history_ttl
+        cache.add_listener(self.apply_observation)
+
+    def add_listener(self, listener: Callable):
+        """Call listener(lat, lon, observation, observed_at) once an observation is applied to the weights."""
+        self._listeners.append(listener)
+
+    def apply_observation(self, lat: float, lon: float, observation: Dict, observed_at: Optional[float] = None):
+        graph = self.graph
+        if graph is None or "speedRatio" not in observation:
+            return
+        graph.apply_speed_ratio(lat, lon, observation["speedRatio"], observed_at or time.time())
+        for listener in self._listeners:
+            listener(lat, lon, observation, observed_at)
+
+    def expire_traffic(self):
+        """Reset car weights whose observation is past the history TTL, at most once a minute."""
+        graph = self.graph
+        now = time.time()
+        if graph is not None and now - self._last_expiry > TRAFFIC_EXPIRY_SWEEP_SECONDS:
+            self._last_expiry = now
+            graph.expire_traffic(now - self.history_ttl)
+
+    def route(self, from_lat: float, from_lon: float, to_lat: float, to_lon: float,
+              mode: str = "car") -> Optional[Dict]:
+        """
+        Fastest route between two points.
+
+        Returns:
+            Distance (m), duration (s) and [lon, lat] geometry, or None when
+            the points are not connected
+        """
+        graph = self.graph
+        if graph is None:
+            raise RuntimeError("Road graph not loaded")
+
+        if mode == "car":
+            self.expire_traffic()
+
+        source, source_offset = graph.snap(from_lat, from_lon, mode)
+        target, target_offset = graph.snap(to_lat, to_lon, mode)
+        if source < 0 or target < 0:
+            return None
+        found = graph.shortest_path(source, target, mode)
+        if found is None:
+            return None
+        duration, edges = found
+
+        vertices = [source] + [int(graph.targets[edge]) for edge in edges]
+        coordinates = [[round(float(graph.lon[v]), 6), round(float(graph.lat[v]), 6)] for v in vertices]
+        distance = float(graph.lengths[edges].sum()) if edges else 0.0
+        return {
+            "distance": round(distance, 1),
+            "duration": round(duration, 1),
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "mode": mode,
+            "snapDistance": [round(source_offset, 1), round(target_offset, 1)],
+        }
+
+    def status(self) -> Dict:
+        graph = self.graph
+        return {
+            "loaded": graph is not None,
+            "loadedAt": self.loaded_at,
+            "vertices": graph.vertex_count if graph else 0,
+            "edges": graph.edge_count if graph else 0,
+            "source": self.osm_path,
+        }
+
+
+router = RoadRouter()
@@ -89,3 +89,9 @@ class TransitPlanRequest(BaseModel):
     from_stop_id: str
     to_stop_id: str
     departure_time: Optional[datetime] = None
+
+# Traffic Schemas
+class TrafficEtaRequest(BaseModel):
+    routes: List[List[List[float]]]
+    departure_time: Optional[datetime] = None
+    include_segments: bool = True
@@ -0,0 +1,149 @@
+import math
+from typing import List, Optional
+
+EARTH_RADIUS_M = 6371000.0
+
+# Tolerances (metres) precomputed for every route when the feed loads
+TOLERANCE_LEVELS = (2.0, 5.0, 10.0, 25.0, 50.0)
+
+# Keys under which gtfs_service returns the point list of a route shape
+SHAPE_KEYS = ("shape", "coordinates", "path", "points")
+
+
+def _importance(points: List[List[float]], min_tolerance_m: float) -> List[float]:
+    """
+    Run Douglas-Peucker once and record, for every point, the largest
+    tolerance at which it is still kept. Filtering on this value gives the
+    exact Douglas-Peucker result for any tolerance >= min_tolerance_m.
+    """
+    n = len(points)
+    importance = [0.0] * n
+    importance[0] = importance[-1] = float("inf")
+    if n < 3:
+        return importance
+
+    cos_lat0 = math.cos(math.radians(points[0][0]))
+    scale = math.pi / 180.0 * EARTH_RADIUS_M
+    xs = [p[1] * scale * cos_lat0 for p in points]
+    ys = [p[0] * scale for p in points]
+    min_tolerance_sq = min_tolerance_m * min_tolerance_m
+
+    # Iterative version, long shapes would overflow the recursion limit
+    stack = [(0, n - 1, float("inf"))]
+    while stack:
+        first, last, parent_sq = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length_sq = dx * dx + dy * dy
+
+        max_dist_sq = -1.0
+        index = first
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            if length_sq > 0:
+                t = (px * dx + py * dy) / length_sq
+                if t > 1.0:
+                    t = 1.0
+                elif t < 0.0:
+                    t = 0.0
+                px, py = px - t * dx, py - t * dy
+            dist_sq = px * px + py * py
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                index = i
+
+        if max_dist_sq > min_tolerance_sq:
+            # A point is only reached if every enclosing split was kept too
+            kept_sq = min(max_dist_sq, parent_sq)
+            importance[index] = math.sqrt(kept_sq)
+            stack.append((first, index, kept_sq))
+            stack.append((index, last, kept_sq))
+
+    return importance
+
+
+def simplify(points: List[List[float]], tolerance_m: float) -> List[List[float]]:
+    """
+    Simplify a polyline with the Douglas-Peucker algorithm.
+
+    Args:
+        points: List of [lat, lon] points
+        tolerance_m: Maximum allowed deviation from the original line in metres
+
+    Returns:
+        Subset of the input points, always keeping the first and last one
+    """
+    if len(points) < 3 or tolerance_m <= 0:
+        return list(points)
+    importance = _importance(points, tolerance_m)
+    return [point for point, kept in zip(points, importance) if kept > tolerance_m]
+
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode_polyline(points: List[List[float]], precision: int = 5) -> str:
+    """
+    Encode points with the Google encoded polyline algorithm.
+
+    Points are encoded in the order they are given ([lat, lon] for Leaflet
+    plugins such as Polyline.encoded).
+    """
+    factor = 10 ** precision
+    result = []
+    prev_a = prev_b = 0
+    for point in points:
+        a = int(round(point[0] * factor))
+        b = int(round(point[1] * factor))
+        result.append(_encode_value(a - prev_a))
+        result.append(_encode_value(b - prev_b))
+        prev_a, prev_b = a, b
+    return "".join(result)
+
+
+def tolerance_for_zoom(zoom: int, lat: float = 50.04) -> float:
+    """Ground size of one map pixel (metres) at a Web Mercator zoom level."""
+    return 156543.03 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def pick_level(tolerance_m: Optional[float]) -> float:
+    """
+    Choose the coarsest precomputed level that does not exceed the requested
+    tolerance. Returns 0.0 (full geometry) when no level is fine enough.
+    """
+    if not tolerance_m:
+        return 0.0
+    level = 0.0
+    for candidate in TOLERANCE_LEVELS:
+        if candidate <= tolerance_m:
+            level = candidate
+    return level
+
+
+def shape_key(shape: dict) -> Optional[str]:
+    """Find the key holding the point list in a route shape response."""
+    for key in SHAPE_KEYS:
+        value = shape.get(key)
+        if isinstance(value, list) and (not value or isinstance(value[0], (list, tuple))):
+            return key
+    return None
+
+
+def build_levels(points: List[List[float]]) -> dict:
+    """Precompute the simplified geometry for every tolerance level."""
+    levels = {0.0: points}
+    if len(points) < 3:
+        levels.update({tolerance: list(points) for tolerance in TOLERANCE_LEVELS})
+        return levels
+
+    importance = _importance(points, min(TOLERANCE_LEVELS))
+    for tolerance in TOLERANCE_LEVELS:
+        levels[tolerance] = [point for point, kept in zip(points, importance) if kept > tolerance]
+    return levels
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+DB_RETRY_SECONDS = float(os.getenv("DB_RETRY_SECONDS", "5"))
+TRAFFIC_MODEL_PATH = os.getenv("TRAFFIC_MODEL_PATH", "traffic_model.pkl")
+
+
+class Readiness:
+    """
+    Tracks the warmup state of each subsystem.
+
+    Liveness (/health) only says the process is up; readiness (/ready) says
+    every required component has finished warming up.
+    """
+
+    def __init__(self, required: List[str], recovery_checks: Optional[Dict[str, Callable[[], bool]]] = None):
+        self.required = required
+        # Components that can come up after a failed warmup without a retry (e.g. a GTFS reload)
+        self.recovery_checks = recovery_checks or {}
+        self.started_at = datetime.now()
+        self._lock = threading.Lock()
+        self.components: Dict[str, Dict] = {
+            name: {"status": "pending", "detail": None, "duration_ms": None} for name in required
+        }
+
+    def _recover(self):
+        for name, check in self.recovery_checks.items():
+            if self.components[name]["status"] == "failed" and check():
+                self.mark(name, "ok", "loaded after the failed warmup")
+
+    def mark(self, name: str, status: str, detail: Optional[str] = None, duration_ms: Optional[float] = None):
+        with self._lock:
+            self.components[name] = {
+                "status": status,
+                "detail": detail,
+                "duration_ms": round(duration_ms, 1) if duration_ms is not None else None,
+            }
+
+    def is_ready(self) -> bool:
+        self._recover()
+        with self._lock:
+            return all(self.components[name]["status"] in ("ok", "skipped") for name in self.required)
+
+    def report(self) -> Dict:
+        self._recover()
+        with self._lock:
+            components = {name: dict(state) for name, state in self.components.items()}
+        return {
+            "ready": self.is_ready(),
+            "started_at": self.started_at,
+            "components": components,
+        }
+
+
+def create_schema():
+    import database
+    import models
+
+    models.Base.metadata.create_all(bind=database.engine)
+
+
+def load_transit_feed():
+    from transit_feed import transit_feed
+
+    transit_feed.ensure_loaded()
+
+
+def transit_feed_loaded() -> bool:
+    from transit_feed import transit_feed
+
+    return transit_feed.current is not None
+
+
+def load_traffic_model() -> Optional[str]:
+    if not os.path.exists(TRAFFIC_MODEL_PATH):
+        return "no saved model, using heuristic"
+    from analytics import traffic_predictor
+
+    traffic_predictor.load_model(TRAFFIC_MODEL_PATH)
+    return None
+
+
+def load_road_graph() -> Optional[str]:
+    from road_graph import router
+    from traffic_cache import observation_cache
+
+    detail = router.load()
+    if detail is None:
+        router.attach_observations(observation_cache)
+    return detail
+
+
+def _run_step(readiness: Readiness, name: str, step: Callable, stop_event: threading.Event, retry: bool = False):
+    while not stop_event.is_set():
+        readiness.mark(name, "loading")
+        started = time.perf_counter()
+        try:
+            detail = step()
+            status = "skipped" if detail else "ok"
+            readiness.mark(name, status, detail, (time.perf_counter() - started) * 1000)
+            return
+        except Exception as e:
+            print(f"Warmup of {name} failed: {e}")
+            readiness.mark(name, "failed", str(e), (time.perf_counter() - started) * 1000)
+            if not retry:
+                return
+        stop_event.wait(DB_RETRY_SECONDS)
+
+
+WARMUP_STEPS = [
+    ("database", create_schema, True),
+    ("transit_feed", load_transit_feed, False),
+    ("traffic_model", load_traffic_model, False),
+    ("road_graph", load_road_graph, False),
+]
+
+readiness = Readiness([name for name, _, _ in WARMUP_STEPS], {"transit_feed": transit_feed_loaded})
+
+
+def start_warmup() -> threading.Event:
+    """
+    Warm up every subsystem in background threads so the server accepts
+    connections (and answers /health) while heavy data loads. The database
+    step is retried until it succeeds, so a DB outage at boot no longer
+    takes the whole process down.
+
+    Returns:
+        Event that stops pending retries when set
+    """
+    stop_event = threading.Event()
+    for name, step, retry in WARMUP_STEPS:
+        threading.Thread(
+            target=_run_step,
+            args=(readiness, name, step, stop_event, retry),
+            name=f"warmup-{name}",
+            daemon=True,
+        ).start()
+    return stop_event
@@ -0,0 +1,171 @@
+import math
+from typing import Dict, List, Optional
+
+EARTH_RADIUS_M = 6371000.0
+
+
+class StopIndex:
+    """
+    Uniform grid index over stop coordinates for nearest-stop lookups.
+
+    Coordinates are projected to local metres (equirectangular around the mean
+    latitude), which is accurate to well under 1 m at city scale.
+    """
+
+    def __init__(self, stops: List[Dict], cell_size_m: float = 250.0):
+        self.cell_size = cell_size_m
+        self.stops = [stop for stop in stops if stop.get("lat") is not None and stop.get("lon") is not None]
+
+        if self.stops:
+            self.lat0 = sum(stop["lat"] for stop in self.stops) / len(self.stops)
+        else:
+            self.lat0 = 0.0
+        self.cos_lat0 = math.cos(math.radians(self.lat0))
+
+        self.xs: List[float] = []
+        self.ys: List[float] = []
+        self.cells: Dict[tuple, List[int]] = {}
+        for i, stop in enumerate(self.stops):
+            x, y = self._project(stop["lat"], stop["lon"])
+            self.xs.append(x)
+            self.ys.append(y)
+            self.cells.setdefault(self._cell(x, y), []).append(i)
+
+        if self.cells:
+            cell_xs = [cell[0] for cell in self.cells]
+            cell_ys = [cell[1] for cell in self.cells]
+            self.bounds = (min(cell_xs), min(cell_ys), max(cell_xs), max(cell_ys))
+        else:
+            self.bounds = (0, 0, 0, 0)
+
+    def _project(self, lat: float, lon: float) -> tuple:
+        x = math.radians(lon) * EARTH_RADIUS_M * self.cos_lat0
+        y = math.radians(lat) * EARTH_RADIUS_M
+        return x, y
+
+    def _cell(self, x: float, y: float) -> tuple:
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _ring(self, cx: int, cy: int, r: int):
+        """Yield stop indices from the cells at Chebyshev distance r from (cx, cy)."""
+        if r == 0:
+            yield from self.cells.get((cx, cy), ())
+            return
+        for dx in range(-r, r + 1):
+            yield from self.cells.get((cx + dx, cy - r), ())
+            yield from self.cells.get((cx + dx, cy + r), ())
+        for dy in range(-r + 1, r):
+            yield from self.cells.get((cx - r, cy + dy), ())
+            yield from self.cells.get((cx + r, cy + dy), ())
+
+    def _max_ring(self, cx: int, cy: int) -> int:
+        min_x, min_y, max_x, max_y = self.bounds
+        return max(abs(cx - min_x), abs(cx - max_x), abs(cy - min_y), abs(cy - max_y))
+
+    def _result(self, i: int, distance: float) -> Dict:
+        return {**self.stops[i], "distance": round(distance, 1)}
+
+    def nearest(self, lat: float, lon: float, k: int = 5, max_distance: Optional[float] = None) -> List[Dict]:
+        """
+        Find the k stops closest to a point.
+
+        Args:
+            lat, lon: Query point
+            k: Number of stops to return
+            max_distance: Optional cut-off in metres
+
+        Returns:
+            Stops sorted by distance, each with an added 'distance' in metres
+        """
+        if not self.stops or k <= 0:
+            return []
+
+        x, y = self._project(lat, lon)
+        cx, cy = self._cell(x, y)
+        last_ring = self._max_ring(cx, cy)
+        if max_distance is not None:
+            last_ring = min(last_ring, int(max_distance // self.cell_size) + 1)
+
+        candidates = []
+        r = 0
+        while r <= last_ring:
+            for i in self._ring(cx, cy, r):
+                distance = math.hypot(self.xs[i] - x, self.ys[i] - y)
+                if max_distance is None or distance <= max_distance:
+                    candidates.append((distance, i))
+            # Every stop outside ring r is at least r cells away
+            if len(candidates) >= k:
+                candidates.sort()
+                if candidates[k - 1][0] <= r * self.cell_size:
+                    break
+            r += 1
+
+        candidates.sort()
+        return [self._result(i, distance) for distance, i in candidates[:k]]
+
+    def _within(self, x: float, y: float, radius: float) -> List[tuple]:
+        return self._near_segment(x, y, x, y, radius)
+
+    def _near_segment(self, ax: float, ay: float, bx: float, by: float, radius: float) -> List[tuple]:
+        """(distance, index) of every stop within radius of the segment from a to b."""
+        min_cx, min_cy = self._cell(min(ax, bx) - radius, min(ay, by) - radius)
+        max_cx, max_cy = self._cell(max(ax, bx) + radius, max(ay, by) + radius)
+        min_cx, min_cy = max(min_cx, self.bounds[0]), max(min_cy, self.bounds[1])
+        max_cx, max_cy = min(max_cx, self.bounds[2]), min(max_cy, self.bounds[3])
+
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        found = []
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                for i in self.cells.get((cx, cy), ()):
+                    px, py = self.xs[i] - ax, self.ys[i] - ay
+                    if length_sq > 0:
+                        t = max(0.0, min(1.0, (px * dx + py * dy) / length_sq))
+                        px, py = px - t * dx, py - t * dy
+                    distance = math.hypot(px, py)
+                    if distance <= radius:
+                        found.append((distance, i))
+        return found
+
+    def within(self, lat: float, lon: float, radius: float, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Find all stops within a radius (metres) of a point, nearest first.
+        """
+        if not self.stops or radius < 0:
+            return []
+
+        x, y = self._project(lat, lon)
+        found = sorted(self._within(x, y, radius))
+        if limit is not None:
+            found = found[:limit]
+        return [self._result(i, distance) for distance, i in found]
+
+    def near_route(self, coordinates: List[List[float]], radius: float, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Find stops within a radius (metres) of a route.
+
+        Args:
+            coordinates: Route as a list of [lon, lat] points
+            radius: Maximum distance from the route in metres
+            limit: Optional maximum number of stops
+
+        Returns:
+            Stops sorted by distance to the route line (not only its vertices)
+        """
+        if not self.stops or radius < 0 or not coordinates:
+            return []
+
+        points = [self._project(coord[1], coord[0]) for coord in coordinates]
+        if len(points) == 1:
+            points.append(points[0])
+        best: Dict[int, float] = {}
+        for (ax, ay), (bx, by) in zip(points, points[1:]):
+            for distance, i in self._near_segment(ax, ay, bx, by, radius):
+                if distance < best.get(i, float("inf")):
+                    best[i] = distance
+
+        found = sorted((distance, i) for i, distance in best.items())
+        if limit is not None:
+            found = found[:limit]
+        return [self._result(i, distance) for distance, i in found]
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Observations are shared per ~100 m cell (3 decimal places of lat/lon)
+CELL_PRECISION = 3
+
+
+def cell_key(lat: float, lon: float) -> Tuple[float, float]:
+    return round(lat, CELL_PRECISION), round(lon, CELL_PRECISION)
+
+
+class ObservationCache:
+    """
+    In-memory store of the latest traffic observation per location cell.
+
+    Entries younger than fresh_ttl are served as current data, older ones
+    (up to history_ttl) are only used to fill points the upstream did not
+    answer in time. The least recently used cells are evicted past max_cells.
+    """
+
+    def __init__(self, fresh_ttl: float = 120.0, history_ttl: float = 3600.0, max_cells: int = 50000):
+        self.fresh_ttl = fresh_ttl
+        self.history_ttl = history_ttl
+        self.max_cells = max_cells
+        self._entries: "OrderedDict[Tuple[float, float], Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners: List[Callable] = []
+
+    def add_listener(self, listener: Callable):
+        """Call listener(lat, lon, observation, observed_at) after every put."""
+        self._listeners.append(listener)
+
+    def put(self, lat: float, lon: float, observation: Dict, observed_at: Optional[float] = None):
+        key = cell_key(lat, lon)
+        observed_at = observed_at if observed_at is not None else time.time()
+        with self._lock:
+            self._entries[key] = (observed_at, observation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_cells:
+                self._entries.popitem(last=False)
+        for listener in self._listeners:
+            listener(lat, lon, observation, observed_at)
+
+    def get(self, lat: float, lon: float, max_age: float) -> Optional[Tuple[float, Dict]]:
+        """Return (age in seconds, observation) if the cell was observed within max_age."""
+        key = cell_key(lat, lon)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        age = time.time() - entry[0]
+        if age > max_age:
+            return None
+        return age, entry[1]
+
+    def get_fresh(self, lat: float, lon: float) -> Optional[Tuple[float, Dict]]:
+        return self.get(lat, lon, self.fresh_ttl)
+
+    def get_history(self, lat: float, lon: float) -> Optional[Tuple[float, Dict]]:
+        return self.get(lat, lon, self.history_ttl)
+
+    def snapshot(self, max_age: float) -> List[Tuple[Tuple[float, float], float, Dict]]:
+        """(cell, age, observation) of every cell observed within max_age."""
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries.items())
+        return [(key, now - observed_at, observation) for key, (observed_at, observation) in entries
+                if now - observed_at <= max_age]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+observation_cache = ObservationCache(
+    fresh_ttl=float(os.getenv("TRAFFIC_CACHE_TTL_SECONDS", "120")),
+    history_ttl=float(os.getenv("TRAFFIC_HISTORY_TTL_SECONDS", "3600")),
+)
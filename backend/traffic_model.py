@@ -1,6 +1,17 @@
 from datetime import datetime
+from typing import Dict, List
 import math
 
+import numpy as np
+
+from traffic_service import get_traffic_color
+
+EARTH_RADIUS_M = 6371008.8
+# Speed used when no traffic point covers the route, matches the simulation's free flow
+DEFAULT_SPEED_KMH = 50.0
+# Closures and standstill readings give long but finite travel times
+MIN_SPEED_KMH = 3.0
+
 def calculate_traffic_delay(base_duration_seconds: float) -> dict:
     """
     Calculates estimated traffic delay based on current time and typical congestion patterns.
@@ -62,3 +73,110 @@ def calculate_traffic_delay(base_duration_seconds: float) -> dict:
         "traffic_level": traffic_level,
         "congestion_factor": round(congestion_factor, 2)
     }
+
+
+def segment_lengths(coordinates) -> np.ndarray:
+    """
+    Haversine length of every segment of a route.
+
+    Args:
+        coordinates: [lon, lat] points (list or (n, 2) array)
+
+    Returns:
+        Array of n - 1 lengths in metres
+    """
+    coords = np.asarray(coordinates, dtype=np.float64)
+    if coords.ndim != 2 or len(coords) < 2:
+        return np.zeros(0)
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(coords[:, 1])
+    a = (np.sin(np.diff(lat) / 2) ** 2
+         + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def nearest_traffic_points(coords: np.ndarray, traffic_points: List[Dict]) -> np.ndarray:
+    """Index of the nearest traffic point for every segment midpoint of a [lon, lat] array."""
+    mid_lon = (coords[:-1, 0] + coords[1:, 0]) / 2
+    mid_lat = (coords[:-1, 1] + coords[1:, 1]) / 2
+    point_lon = np.array([p["lon"] for p in traffic_points])
+    point_lat = np.array([p["lat"] for p in traffic_points])
+    # Equirectangular distance is enough to rank points a few kilometres apart
+    scale = math.cos(math.radians(float(mid_lat.mean())))
+    d_lon = (mid_lon[:, None] - point_lon[None, :]) * scale
+    d_lat = mid_lat[:, None] - point_lat[None, :]
+    return np.argmin(d_lon ** 2 + d_lat ** 2, axis=1)
+
+
+def estimate_travel_time(coordinates, traffic_points: List[Dict], include_segments: bool = True) -> Dict:
+    """
+    Traffic-aware travel time along a route.
+
+    Every segment of the route takes the current and free-flow speed of its
+    nearest traffic point (live, cached or simulated). Consecutive segments
+    sharing a traffic point are reported together as one section.
+
+    Args:
+        coordinates: Route as [lon, lat] points
+        traffic_points: Points from traffic_service (currentSpeed/freeFlowSpeed in km/h)
+        include_segments: Whether to return per-section times
+
+    Returns:
+        Dictionary with distance (m), duration, freeFlowDuration and delay (s),
+        and the sections when requested
+    """
+    coords = np.asarray(coordinates, dtype=np.float64)
+    lengths = segment_lengths(coords)
+    if len(lengths) == 0:
+        result = {"distance": 0.0, "duration": 0.0, "freeFlowDuration": 0.0, "delay": 0.0}
+        if include_segments:
+            result["segments"] = []
+        return result
+
+    if traffic_points:
+        assigned = nearest_traffic_points(coords, traffic_points)
+        current = np.array([p["currentSpeed"] for p in traffic_points], dtype=np.float64)[assigned]
+        free_flow = np.array([p["freeFlowSpeed"] for p in traffic_points], dtype=np.float64)[assigned]
+    else:
+        assigned = np.zeros(len(lengths), dtype=np.int64)
+        current = free_flow = np.full(len(lengths), DEFAULT_SPEED_KMH)
+
+    # km/h -> m/s
+    durations = lengths / (np.maximum(current, MIN_SPEED_KMH) / 3.6)
+    free_flow_durations = lengths / (np.maximum(free_flow, MIN_SPEED_KMH) / 3.6)
+
+    duration = float(durations.sum())
+    free_flow_duration = float(free_flow_durations.sum())
+    result = {
+        "distance": round(float(lengths.sum()), 1),
+        "duration": round(duration, 1),
+        "freeFlowDuration": round(free_flow_duration, 1),
+        "delay": round(max(0.0, duration - free_flow_duration), 1),
+    }
+    if not include_segments:
+        return result
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(assigned)) + 1))
+    ends = np.append(starts[1:], len(lengths))
+    section_lengths = np.add.reduceat(lengths, starts)
+    section_durations = np.add.reduceat(durations, starts)
+    section_free_flow = np.add.reduceat(free_flow_durations, starts)
+
+    sections = []
+    for start, end, length, section_duration, section_free in zip(
+            starts.tolist(), ends.tolist(), section_lengths.tolist(),
+            section_durations.tolist(), section_free_flow.tolist()):
+        point = traffic_points[assigned[start]] if traffic_points else None
+        speed_ratio = section_free / section_duration if section_duration > 0 else 1.0
+        sections.append({
+            "from": start,
+            "to": end,
+            "distance": round(length, 1),
+            "duration": round(section_duration, 1),
+            "freeFlowDuration": round(section_free, 1),
+            "speed": round(length / section_duration * 3.6, 1) if section_duration > 0 else 0.0,
+            "color": get_traffic_color(speed_ratio),
+            "source": point["source"] if point else "default",
+        })
+    result["segments"] = sections
+    return result
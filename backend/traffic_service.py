@@ -1,80 +1,272 @@
 import os
+import time
+import random
+import asyncio
 import httpx
-from typing import List, Dict, Tuple
+import metrics
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
+from circuit_breaker import CircuitBreaker
+from rate_limit import PRIORITY_INTERACTIVE, PRIORITY_PREFETCH, BackgroundBudget, tomtom_budget
+from traffic_cache import observation_cache
 
 load_dotenv()
 
 TOMTOM_API_KEY = os.getenv("TOMTOM_API_KEY", "")
+# Override to point at a local stand-in (see benchmarks/mock_tomtom.py)
+TOMTOM_BASE_URL = os.getenv("TOMTOM_BASE_URL", "https://api.tomtom.com").rstrip("/")
 
-async def get_traffic_flow_segments(coordinates: List[List[float]], zoom: int = 10) -> List[Dict]:
+# End-to-end budget for all upstream calls of one request, and the limit for a single call
+TRAFFIC_DEADLINE_SECONDS = float(os.getenv("TRAFFIC_DEADLINE_SECONDS", "2.5"))
+TOMTOM_CALL_TIMEOUT_SECONDS = float(os.getenv("TOMTOM_CALL_TIMEOUT_SECONDS", "2.0"))
+TOMTOM_MAX_CONCURRENCY = int(os.getenv("TOMTOM_MAX_CONCURRENCY", "8"))
+
+# Number of interactive requests currently calling TomTom, prefetching waits while it is non-zero
+interactive_in_flight = 0
+
+tomtom_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("TOMTOM_BREAKER_FAILURES", "5")),
+    cooldown_seconds=float(os.getenv("TOMTOM_BREAKER_COOLDOWN_SECONDS", "30")),
+)
+
+
+def observation_point(index: int, lat: float, lon: float, observation: Dict, source: str,
+                      age: float = 0.0) -> Dict:
+    """Build a traffic point from a stored or fresh observation."""
+    confidence = observation.get("confidence", 0.5)
+    if source == "history":
+        # Older observations are trusted less
+        confidence *= max(0.1, 1.0 - age / observation_cache.history_ttl)
+    return {
+        "index": index,
+        "lat": lat,
+        "lon": lon,
+        "currentSpeed": observation["currentSpeed"],
+        "freeFlowSpeed": observation["freeFlowSpeed"],
+        "speedRatio": observation["speedRatio"],
+        "color": get_traffic_color(observation["speedRatio"]),
+        "confidence": confidence,
+        "source": source,
+        "observationAge": round(age, 1),
+    }
+
+
+async def fetch_flow_point(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, index: int,
+                           lat: float, lon: float, zoom: int) -> Optional[Dict]:
+    """
+    Fetch one point from the TomTom Traffic Flow API.
+
+    Returns:
+        Traffic point, or None if the upstream did not give a usable answer
+    """
+    url = f"{TOMTOM_BASE_URL}/traffic/services/4/flowSegmentData/absolute/{zoom}/json"
+    params = {
+        "key": TOMTOM_API_KEY,
+        "point": f"{lat},{lon}",
+        "unit": "KMPH"
+    }
+
+    started = time.perf_counter()
+    try:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(url, params=params)
+    except asyncio.CancelledError:
+        # Cut by the caller's deadline, which says nothing about upstream health
+        tomtom_breaker.release_trial()
+        raise
+    except Exception as e:
+        metrics.TOMTOM_REQUEST_DURATION.observe(time.perf_counter() - started)
+        metrics.TOMTOM_REQUESTS.inc(status="timeout" if isinstance(e, httpx.TimeoutException) else "error")
+        tomtom_breaker.record_failure()
+        print(f"Error fetching traffic: {e}")
+        return None
+
+    metrics.TOMTOM_REQUEST_DURATION.observe(time.perf_counter() - started)
+    if response.status_code != 200:
+        metrics.TOMTOM_REQUESTS.inc(status=response.status_code)
+        # Throttling and server errors mean the upstream is unhealthy, other 4xx are about the point
+        if response.status_code == 429 or response.status_code >= 500:
+            tomtom_breaker.record_failure()
+        else:
+            tomtom_breaker.release_trial()
+        return None
+
+    try:
+        flow_data = response.json().get("flowSegmentData", {})
+        current_speed = float(flow_data.get("currentSpeed", 0))
+        free_flow_speed = float(flow_data.get("freeFlowSpeed", 1))
+        observation = {
+            "currentSpeed": current_speed,
+            "freeFlowSpeed": free_flow_speed,
+            "speedRatio": current_speed / free_flow_speed if free_flow_speed > 0 else 1.0,
+            "confidence": flow_data.get("confidence", 0.5),
+        }
+    except (ValueError, TypeError, AttributeError) as e:
+        # A 200 with an HTML or truncated body comes from a broken proxy or upstream
+        metrics.TOMTOM_REQUESTS.inc(status="invalid_body")
+        tomtom_breaker.record_failure()
+        print(f"Invalid TomTom response: {e}")
+        return None
+    metrics.TOMTOM_REQUESTS.inc(status=response.status_code)
+    tomtom_breaker.record_success()
+    observation_cache.put(lat, lon, observation)
+    return observation_point(index, lat, lon, observation, "tomtom")
+
+
+async def fetch_points_within_deadline(points: List[Tuple[int, float, float]], zoom: int, deadline: float,
+                                       background_budget: Optional[BackgroundBudget] = None) -> Dict[int, Dict]:
+    """
+    Fetch points concurrently until the deadline (time.monotonic()) passes.
+    Calls still running at the deadline are cancelled. They are counted in
+    metrics only, not as breaker failures, and release a half-open trial.
+
+    Args:
+        background_budget: Budget of a background caller; it is not counted as
+            interactive and never spends the interactive reserve. Interactive
+            requests leave it out.
+
+    Returns:
+        Traffic points by index, only for points that were answered
+    """
+    global interactive_in_flight
+
+    budget = background_budget or tomtom_budget
+    priority = PRIORITY_PREFETCH if background_budget else PRIORITY_INTERACTIVE
+    interactive = background_budget is None
+    results = {}
+    semaphore = asyncio.Semaphore(TOMTOM_MAX_CONCURRENCY)
+    if interactive:
+        interactive_in_flight += 1
+    try:
+        async with httpx.AsyncClient(timeout=TOMTOM_CALL_TIMEOUT_SECONDS) as client:
+            tasks = {}
+            for index, lat, lon in points:
+                if not budget.try_acquire(priority):
+                    metrics.TOMTOM_REQUESTS.inc(status="budget")
+                    continue
+                if not tomtom_breaker.allow():
+                    budget.refund()
+                    metrics.TOMTOM_REQUESTS.inc(status="circuit_open")
+                    continue
+                task = asyncio.create_task(fetch_flow_point(client, semaphore, index, lat, lon, zoom))
+                tasks[task] = index
+            if not tasks:
+                return results
+
+            done, not_done = await asyncio.wait(tasks, timeout=max(0.0, deadline - time.monotonic()))
+            for task in not_done:
+                # Running out of this request's budget says nothing about upstream health,
+                # many of these calls never left the semaphore
+                task.cancel()
+                metrics.TOMTOM_REQUESTS.inc(status="deadline")
+            if not_done:
+                await asyncio.gather(*not_done, return_exceptions=True)
+                # A task cancelled before it started never reached fetch_flow_point's handler
+                tomtom_breaker.release_trial()
+
+            for task in done:
+                error = task.exception()
+                if error is not None:
+                    metrics.TOMTOM_REQUESTS.inc(status="error")
+                    print(f"Error fetching traffic: {error}")
+                    continue
+                point = task.result()
+                if point is not None:
+                    results[tasks[task]] = point
+    finally:
+        if interactive:
+            interactive_in_flight -= 1
+    return results
+
+
+async def get_traffic_flow_segments(coordinates: List[List[float]], zoom: int = 10,
+                                    deadline_seconds: Optional[float] = None,
+                                    max_points: int = 20, live_limit: Optional[int] = None) -> List[Dict]:
     """
     Fetch traffic flow data for route segments from TomTom Traffic Flow API.
+
+    Every sampled point is answered within the latency budget. Points come
+    from the fresh cache or TomTom. Points TomTom does not answer in time, or
+    skipped while the circuit breaker is open, are filled from older
+    observations ('history') or the simulation. Each point carries its
+    provenance in 'source'.
     
     Args:
         coordinates: List of [lon, lat] coordinate pairs representing the route
         zoom: Zoom level (10-22, higher = more detailed)
+        deadline_seconds: Latency budget for upstream calls (default: TRAFFIC_DEADLINE_SECONDS)
+        max_points: Number of points sampled along the route
+        live_limit: Most points fetched from TomTom, in sampling order; the rest
+            are filled like unanswered points (default: no limit)
     
     Returns:
         List of segments with traffic data including color coding
     """
-    if not TOMTOM_API_KEY:
-        raise ValueError("TOMTOM_API_KEY not configured")
-    
-    segments = []
-    
-    sampled_coords = sample_coordinates(coordinates, max_points=20)
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for i, coord in enumerate(sampled_coords):
-            lon, lat = coord[0], coord[1]
-            
-            url = f"https://api.tomtom.com/traffic/services/4/flowSegmentData/absolute/{zoom}/json"
-            params = {
-                "key": TOMTOM_API_KEY,
-                "point": f"{lat},{lon}",
-                "unit": "KMPH"
-            }
-            
-            try:
-                response = await client.get(url, params=params)
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    flow_data = data.get("flowSegmentData", {})
-                    current_speed = flow_data.get("currentSpeed", 0)
-                    free_flow_speed = flow_data.get("freeFlowSpeed", 1)
-                    confidence = flow_data.get("confidence", 0.5)
-                    
-                    speed_ratio = current_speed / free_flow_speed if free_flow_speed > 0 else 1.0
-                    color = get_traffic_color(speed_ratio)
-                    
-                    segments.append({
-                        "index": i,
-                        "lat": lat,
-                        "lon": lon,
-                        "currentSpeed": current_speed,
-                        "freeFlowSpeed": free_flow_speed,
-                        "speedRatio": speed_ratio,
-                        "color": color,
-                        "confidence": confidence
-                    })
-                    
-            except Exception as e:
-                print(f"Error fetching traffic: {e}")
-                segments.append({
-                    "index": i,
-                    "lat": lat,
-                    "lon": lon,
-                    "color": "green",
-                    "speedRatio": 1.0,
-                    "confidence": 0.0
-                })
-    
+    deadline = time.monotonic() + (deadline_seconds if deadline_seconds is not None else TRAFFIC_DEADLINE_SECONDS)
+
+    with metrics.TRAFFIC_STAGE_DURATION.time(stage="sample"):
+        sampled_coords = sample_coordinates(coordinates, max_points=max_points)
+
+    segments: List[Optional[Dict]] = [None] * len(sampled_coords)
+    missing = []
+    for i, coord in enumerate(sampled_coords):
+        lon, lat = coord[0], coord[1]
+        cached = observation_cache.get_fresh(lat, lon)
+        metrics.record_cache("traffic_observations", hit=cached is not None)
+        if cached is not None:
+            age, observation = cached
+            segments[i] = observation_point(i, lat, lon, observation, "cache", age)
+        else:
+            missing.append((i, lat, lon))
+
+    if live_limit is not None:
+        missing = missing[:live_limit]
+    if missing and TOMTOM_API_KEY:
+        fetched = await fetch_points_within_deadline(missing, zoom, deadline)
+        for index, point in fetched.items():
+            segments[index] = point
+
+    congestion_factor = None
+    for i, coord in enumerate(sampled_coords):
+        if segments[i] is not None:
+            continue
+        lon, lat = coord[0], coord[1]
+        stored = observation_cache.get_history(lat, lon)
+        if stored is not None:
+            age, observation = stored
+            segments[i] = observation_point(i, lat, lon, observation, "history", age)
+        else:
+            if congestion_factor is None:
+                congestion_factor = calculate_congestion_factor(datetime.now())
+            segments[i] = simulate_point(i, lat, lon, congestion_factor)
+
+    for segment in segments:
+        metrics.TRAFFIC_POINT_SOURCES.inc(source=segment["source"])
     return segments
 
 
+def simulate_point(index: int, lat: float, lon: float, congestion_factor: float) -> Dict:
+    """Simulated traffic for a single point around the given congestion level."""
+    random_variation = (random.random() * 0.3) - 0.15
+    segment_congestion = max(0.0, min(1.0, congestion_factor + random_variation))
+    speed_ratio = 1.0 - (segment_congestion * 0.8)
+    color = get_traffic_color(speed_ratio)
+
+    return {
+        "index": index,
+        "lat": lat,
+        "lon": lon,
+        "currentSpeed": 50 * speed_ratio,
+        "freeFlowSpeed": 50,
+        "speedRatio": speed_ratio,
+        "color": color,
+        "confidence": 1.0,
+        "source": "simulation"
+    }
+
+
 def get_simulated_traffic(coordinates: List[List[float]], simulation_time: datetime) -> List[Dict]:
     """
     Generate simulated traffic data based on time of day and day of week.
@@ -86,32 +278,13 @@ def get_simulated_traffic(coordinates: List[List[float]], simulation_time: datet
     Returns:
         List of segments with simulated traffic data
     """
-    segments = []
     sampled_coords = sample_coordinates(coordinates, max_points=20)
     congestion_factor = calculate_congestion_factor(simulation_time)
     
-    import random
-    
-    for i, coord in enumerate(sampled_coords):
-        lon, lat = coord[0], coord[1]
-        random_variation = (random.random() * 0.3) - 0.15
-        segment_congestion = max(0.0, min(1.0, congestion_factor + random_variation))
-        speed_ratio = 1.0 - (segment_congestion * 0.8)
-        color = get_traffic_color(speed_ratio)
-
-        segments.append({
-            "index": i,
-            "lat": lat,
-            "lon": lon,
-            "currentSpeed": 50 * speed_ratio,
-            "freeFlowSpeed": 50,
-            "speedRatio": speed_ratio,
-            "color": color,
-            "confidence": 1.0,
-            "source": "simulation"
-        })
-        
-    return segments
+    return [
+        simulate_point(i, coord[1], coord[0], congestion_factor)
+        for i, coord in enumerate(sampled_coords)
+    ]
 
 
 def calculate_congestion_factor(sim_time: datetime) -> float:
@@ -0,0 +1,312 @@
+import asyncio
+import itertools
+import math
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+import metrics
+import traffic_service
+from rate_limit import live_traffic_budget
+from traffic_cache import cell_key, observation_cache
+
+LIVE_TRAFFIC_POLL_SECONDS = float(os.getenv("LIVE_TRAFFIC_POLL_SECONDS", "60"))
+MAX_SUBSCRIPTIONS_PER_CONNECTION = 5
+MAX_SUBSCRIPTION_COORDINATES = 10000
+# Upper bound on TomTom calls per poll round, whatever the budget allows
+LIVE_TRAFFIC_MAX_POINTS_PER_ROUND = int(os.getenv("LIVE_TRAFFIC_MAX_POINTS_PER_ROUND", "200"))
+# Messages queued for a client that does not keep up before it is disconnected
+SEND_QUEUE_LIMIT = 100
+# Changes arriving within this window (one poll round's answers) go out as one message
+FLUSH_DELAY_SECONDS = 0.05
+
+
+class Connection:
+    """Outgoing side of one client; messages are sent in order by pump()."""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.subscriptions: Dict[int, "Subscription"] = {}
+        self.closed = False
+
+    def send(self, message: Dict):
+        if self.closed:
+            return
+        if self.queue.qsize() >= SEND_QUEUE_LIMIT:
+            # A stalled client must not hold updates for everyone else in memory
+            self.closed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return
+        self.queue.put_nowait(message)
+
+    async def pump(self, send: Callable[[Dict], Awaitable], close: Callable[[], Awaitable]):
+        while True:
+            message = await self.queue.get()
+            if message is None:
+                await close()
+                return
+            await send(message)
+
+
+class Subscription:
+    def __init__(self, subscription_id: int, connection: Connection, cells: List[Tuple[float, float]],
+                 ranges: List[Tuple[int, int]]):
+        self.id = subscription_id
+        self.connection = connection
+        # Cell of every sampled point, in route order
+        self.cells = cells
+        self.ranges = ranges
+        self.colors: List[Optional[str]] = [None] * len(cells)
+
+
+class CellWatch:
+    """A watched location cell, polled once per interval however many routes pass through it."""
+
+    def __init__(self, key: Tuple[float, float], lat: float, lon: float):
+        self.key = key
+        self.lat = lat
+        self.lon = lon
+        self.subscriptions: Set[Subscription] = set()
+        self.point: Optional[Dict] = None
+
+
+def point_ranges(coordinates: List[List[float]], sampled: List[List[float]]) -> List[Tuple[int, int]]:
+    """Route vertex range [from, to] colored by each sampled point, as interpolate_traffic_segments does."""
+    vertices = np.array([coord[:2] for coord in coordinates], dtype=float)
+    points = np.array([coord[:2] for coord in sampled], dtype=float)
+    # argmin keeps the first of equally near points, like min() over the sampled indices
+    owners = ((vertices[:, None, :] - points[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    ranges = []
+    for owner in range(len(sampled)):
+        owned = np.flatnonzero(owners == owner)
+        ranges.append((int(owned[0]), int(owned[-1])) if len(owned) else (0, -1))
+    return ranges
+
+
+def is_coordinate(point) -> bool:
+    """A [lon, lat, ...] point with finite numeric values inside the valid ranges."""
+    if not isinstance(point, list) or len(point) < 2:
+        return False
+    lon, lat = point[0], point[1]
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+               for value in (lon, lat)):
+        return False
+    return -180 <= lon <= 180 and -90 <= lat <= 90
+
+
+class SubscriptionHub:
+    """
+    Live traffic for routes watched over WebSockets.
+
+    Routes are reduced to the same sampled points as /traffic/flow and each
+    point to its observation cell. Every distinct cell is refreshed from
+    TomTom at most once per LIVE_TRAFFIC_POLL_SECONDS, through the same
+    deadline and circuit breaker as interactive requests, so the upstream
+    cost follows the number of watched cells rather than clients. The poller
+    has its own budget (LIVE_TRAFFIC_DAILY_BUDGET) and never spends the
+    interactive reserve of the shared one.
+    Observations stored by any other path (/traffic/flow, prefetch) are
+    pushed immediately. Subscribers receive only the points whose color
+    changed.
+    """
+
+    def __init__(self, poll_seconds: float = LIVE_TRAFFIC_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.cells: Dict[Tuple[float, float], CellWatch] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ids = itertools.count(1)
+        self._pending: Set[Tuple[float, float]] = set()
+        self._flush_scheduled = False
+        self._wake: Optional[asyncio.Event] = None
+
+    # Subscriptions
+
+    def handle(self, connection: Connection, message: Dict) -> Dict:
+        """Answer one client message (subscribe or unsubscribe)."""
+        action = message.get("action") if isinstance(message, dict) else None
+        if action == "subscribe":
+            coordinates = message.get("coordinates")
+            if not isinstance(coordinates, list) or len(coordinates) < 2 or not all(map(is_coordinate, coordinates)):
+                return {"type": "error", "detail": "coordinates must be a list of [lon, lat] points"}
+            if len(coordinates) > MAX_SUBSCRIPTION_COORDINATES:
+                return {"type": "error", "detail": f"At most {MAX_SUBSCRIPTION_COORDINATES} coordinates"}
+            if len(connection.subscriptions) >= MAX_SUBSCRIPTIONS_PER_CONNECTION:
+                return {"type": "error", "detail": f"At most {MAX_SUBSCRIPTIONS_PER_CONNECTION} subscriptions"}
+            return self.subscribe(connection, coordinates)
+        if action == "unsubscribe":
+            removed = self.unsubscribe(connection, message.get("subscription"))
+            if not removed:
+                return {"type": "error", "detail": "Unknown subscription"}
+            return {"type": "unsubscribed", "subscription": message.get("subscription")}
+        return {"type": "error", "detail": "Unknown action"}
+
+    def subscribe(self, connection: Connection, coordinates: List[List[float]]) -> Dict:
+        sampled = traffic_service.sample_coordinates(coordinates, max_points=20)
+        cells = [cell_key(coord[1], coord[0]) for coord in sampled]
+        subscription = Subscription(next(self._ids), connection, cells, point_ranges(coordinates, sampled))
+        connection.subscriptions[subscription.id] = subscription
+
+        new_cells = False
+        for key, coord in zip(cells, sampled):
+            watch = self.cells.get(key)
+            if watch is None:
+                watch = self.cells[key] = CellWatch(key, coord[1], coord[0])
+                watch.point = self._current_point(watch)
+                new_cells = True
+            watch.subscriptions.add(subscription)
+        if new_cells and self._wake is not None:
+            # Fetch live data for the new cells now instead of at the next round
+            self._wake.set()
+
+        segments = []
+        for index, key in enumerate(cells):
+            point = self.cells[key].point
+            subscription.colors[index] = point["color"]
+            segments.append(self._segment(subscription, index, point))
+        return {"type": "subscribed", "subscription": subscription.id, "segments": segments}
+
+    def unsubscribe(self, connection: Connection, subscription_id) -> bool:
+        subscription = connection.subscriptions.pop(subscription_id, None)
+        if subscription is None:
+            return False
+        for key in set(subscription.cells):
+            watch = self.cells.get(key)
+            if watch is None:
+                continue
+            watch.subscriptions.discard(subscription)
+            if not watch.subscriptions:
+                del self.cells[key]
+        return True
+
+    def disconnect(self, connection: Connection):
+        for subscription_id in list(connection.subscriptions):
+            self.unsubscribe(connection, subscription_id)
+        connection.closed = True
+
+    @staticmethod
+    def _segment(subscription: Subscription, index: int, point: Dict) -> Dict:
+        start, end = subscription.ranges[index]
+        return {
+            "index": index,
+            "from": start,
+            "to": end,
+            "color": point["color"],
+            "speedRatio": round(point["speedRatio"], 3),
+            "source": point["source"],
+        }
+
+    # Updates
+
+    def _current_point(self, watch: CellWatch) -> Dict:
+        stored = observation_cache.get_fresh(watch.lat, watch.lon)
+        source = "cache"
+        if stored is None:
+            stored = observation_cache.get_history(watch.lat, watch.lon)
+            source = "history"
+        if stored is not None:
+            age, observation = stored
+            return traffic_service.observation_point(0, watch.lat, watch.lon, observation, source, age)
+        # No random variation here, it would be pushed to clients as a change every round
+        speed_ratio = 1.0 - traffic_service.calculate_congestion_factor(datetime.now()) * 0.8
+        return {
+            "lat": watch.lat,
+            "lon": watch.lon,
+            "speedRatio": speed_ratio,
+            "color": traffic_service.get_traffic_color(speed_ratio),
+            "source": "simulation",
+        }
+
+    def on_observation(self, lat: float, lon: float, observation: Dict, observed_at: float = None):
+        """Observation cache listener, may be called from any thread."""
+        loop = self.loop
+        key = cell_key(lat, lon)
+        if loop is None or key not in self.cells:
+            return
+        loop.call_soon_threadsafe(self._refresh_cell, key)
+
+    def _refresh_cell(self, key: Tuple[float, float]):
+        watch = self.cells.get(key)
+        if watch is None:
+            return
+        point = self._current_point(watch)
+        changed = watch.point is None or point["color"] != watch.point["color"]
+        watch.point = point
+        if changed:
+            self._pending.add(key)
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                asyncio.get_running_loop().call_later(FLUSH_DELAY_SECONDS, self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, set()
+        subscriptions = set()
+        for key in pending:
+            watch = self.cells.get(key)
+            if watch is not None:
+                subscriptions.update(watch.subscriptions)
+
+        for subscription in subscriptions:
+            changes = []
+            for index, key in enumerate(subscription.cells):
+                if key not in pending:
+                    continue
+                point = self.cells[key].point
+                if point["color"] != subscription.colors[index]:
+                    subscription.colors[index] = point["color"]
+                    changes.append(self._segment(subscription, index, point))
+            if changes:
+                metrics.LIVE_TRAFFIC_UPDATES.inc()
+                subscription.connection.send({"type": "update", "subscription": subscription.id,
+                                              "segments": changes})
+
+    async def poll_once(self):
+        """Refresh every watched cell that has no observation from this interval."""
+        watches = list(self.cells.values())
+        stale = [(index, watch.lat, watch.lon) for index, watch in enumerate(watches)
+                 if observation_cache.get(watch.lat, watch.lon, self.poll_seconds) is None]
+        if stale and traffic_service.TOMTOM_API_KEY:
+            # Cells watched by the most routes first, as many as the poller's budget allows this round
+            stale.sort(key=lambda point: len(watches[point[0]].subscriptions), reverse=True)
+            limit = int(min(LIVE_TRAFFIC_MAX_POINTS_PER_ROUND, live_traffic_budget.available()))
+            polled = stale[:max(limit, 0)]
+            deadline = time.monotonic() + traffic_service.TRAFFIC_DEADLINE_SECONDS
+            # Answers land in the observation cache, whose listener pushes the changes
+            fetched = await traffic_service.fetch_points_within_deadline(polled, 10, deadline,
+                                                                         background_budget=live_traffic_budget)
+            metrics.LIVE_TRAFFIC_POLLS.inc(len(fetched), result="fetched")
+            metrics.LIVE_TRAFFIC_POLLS.inc(len(stale) - len(fetched), result="missed")
+        # Cells without fresh data age into history or the simulation
+        for watch in watches:
+            self._refresh_cell(watch.key)
+
+    async def run(self):
+        """Poller loop, started from the application lifespan."""
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self.cells:
+                continue
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f"Live traffic poll failed: {e}")
+
+    def status(self) -> Dict:
+        connections = {id(s.connection) for watch in self.cells.values() for s in watch.subscriptions}
+        subscriptions = {s.id for watch in self.cells.values() for s in watch.subscriptions}
+        return {"cells": len(self.cells), "subscriptions": len(subscriptions), "connections": len(connections)}
+
+
+hub = SubscriptionHub()
+observation_cache.add_listener(hub.on_observation)
@@ -0,0 +1,241 @@
+import hashlib
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from road_graph import MODE_BITS, RoadRouter, router
+from traffic_cache import CELL_PRECISION, ObservationCache, cell_key, observation_cache
+from traffic_service import calculate_congestion_factor, get_traffic_color
+from transit_feed import encode_json
+
+# Below this zoom the overlay would cover more than the city, tiles are served empty
+MIN_ZOOM = 11
+MAX_ZOOM = 22
+# Lowest zoom at which every road is drawn; lower zooms keep only faster roads
+ALL_ROADS_ZOOM = 14
+MIN_SPEED_BY_ZOOM = {11: 70, 12: 60, 13: 50}
+# Simulated colours change with the congestion factor, observations with time
+TILE_MAX_AGE_SECONDS = 300.0
+CACHE_CONTROL = "public, max-age=30"
+COORDINATE_DECIMALS = 5
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(west, south, east, north) in degrees of a slippy-map tile."""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+def tile_for_point(lat: float, lon: float, z: int) -> Tuple[int, int]:
+    n = 2 ** z
+    lat = max(-85.0511, min(85.0511, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class RoadLayer:
+    """
+    One drawable edge per car road segment (a two-way street is drawn once),
+    with the midpoints used to assign edges to tiles.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        car = np.flatnonzero(graph.modes & MODE_BITS["car"])
+        u, v = graph.sources[car].astype(np.int64), graph.targets[car].astype(np.int64)
+        pair_keys = np.minimum(u, v) * graph.vertex_count + np.maximum(u, v)
+        _, first = np.unique(pair_keys, return_index=True)
+        self.edges = car[np.sort(first)]
+        sources, targets = graph.sources[self.edges], graph.targets[self.edges]
+        self.mid_lat = (graph.lat[sources] + graph.lat[targets]) / 2
+        self.mid_lon = (graph.lon[sources] + graph.lon[targets]) / 2
+        self.speeds = graph.speeds[self.edges]
+        # Stable per-edge jitter, so simulated tiles do not flicker between builds
+        self.jitter = ((self.edges.astype(np.int64) * 2654435761) % 1000) / 1000.0 * 0.3 - 0.15
+
+
+class TrafficTiles:
+    """
+    GeoJSON tiles of coloured road segments for a city-wide traffic overlay.
+
+    Built tiles are kept with an ETag derived from their content. A stored
+    observation marks only the tiles over its cell dirty, so they are
+    rebuilt on the next fetch; other tiles are rebuilt only when the
+    simulated congestion level changes or they reach TILE_MAX_AGE_SECONDS.
+    """
+
+    def __init__(self, road_router: RoadRouter, cache: ObservationCache, max_tiles: int = 4096):
+        self.router = road_router
+        self.cache = cache
+        self.max_tiles = max_tiles
+        self._tiles: "OrderedDict[Tuple[int, int, int], Dict]" = OrderedDict()
+        self._dirty = set()
+        self._building = set()
+        self._layer: Optional[RoadLayer] = None
+        self._lock = threading.Lock()
+
+    def mark_dirty(self, lat: float, lon: float, observation: Dict = None, observed_at: float = None):
+        """Invalidate every built tile overlapping the observation's cell."""
+        center_lat, center_lon = cell_key(lat, lon)
+        half_cell = 0.5 / 10 ** CELL_PRECISION
+        with self._lock:
+            if not self._tiles:
+                return
+            for z in range(MIN_ZOOM, MAX_ZOOM + 1):
+                # Tile y grows southwards
+                min_x, min_y = tile_for_point(center_lat + half_cell, center_lon - half_cell, z)
+                max_x, max_y = tile_for_point(center_lat - half_cell, center_lon + half_cell, z)
+                if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self._tiles) + len(self._building):
+                    # At high zooms the cell covers more tiles than are built
+                    keys = [key for key in itertools.chain(self._tiles, self._building) if key[0] == z]
+                else:
+                    keys = [(z, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+                for key in keys:
+                    _, x, y = key
+                    if min_x <= x <= max_x and min_y <= y <= max_y and (key in self._tiles or key in self._building):
+                        self._dirty.add(key)
+
+    def mark_observed_cell(self, lat: float, lon: float, observation: Dict = None, observed_at: float = None):
+        """
+        Observation cache listener for the overlay without a road graph.
+
+        With a graph, road colours come from the car weights, so the router
+        marks tiles dirty only after it has applied the observation.
+        """
+        if self.router.graph is None:
+            self.mark_dirty(lat, lon)
+
+    def _road_layer(self) -> Optional[RoadLayer]:
+        graph = self.router.graph
+        if graph is None:
+            return None
+        layer = self._layer
+        if layer is None or layer.graph is not graph:
+            layer = self._layer = RoadLayer(graph)
+        return layer
+
+    def _is_current(self, key: Tuple[int, int, int], tile: Dict, congestion: float) -> bool:
+        return (key not in self._dirty
+                and tile["graph"] is self.router.graph
+                and tile["congestion"] == congestion
+                and time.time() - tile["built_at"] < TILE_MAX_AGE_SECONDS)
+
+    def get(self, z: int, x: int, y: int) -> Tuple[bytes, str]:
+        """
+        Tile body and ETag, rebuilt only when its data changed.
+
+        Returns:
+            (GeoJSON FeatureCollection bytes, ETag)
+        """
+        key = (z, x, y)
+        congestion = calculate_congestion_factor(datetime.now())
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None and self._is_current(key, tile, congestion):
+                self._tiles.move_to_end(key)
+                metrics.record_cache("traffic_tiles", hit=True)
+                return tile["body"], tile["etag"]
+            self._dirty.discard(key)
+            # Observations arriving while the tile is built mark it dirty again
+            self._building.add(key)
+        metrics.record_cache("traffic_tiles", hit=False)
+
+        graph = self.router.graph
+        try:
+            body = encode_json(self.build(z, x, y, congestion))
+        finally:
+            with self._lock:
+                self._building.discard(key)
+        etag = f'W/"tile-{z}-{x}-{y}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        with self._lock:
+            self._tiles[key] = {"body": body, "etag": etag, "graph": graph,
+                                "congestion": congestion, "built_at": time.time()}
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                evicted, _ = self._tiles.popitem(last=False)
+                self._dirty.discard(evicted)
+        return body, etag
+
+    def build(self, z: int, x: int, y: int, congestion: float) -> Dict:
+        if z < MIN_ZOOM:
+            return {"type": "FeatureCollection", "features": []}
+        west, south, east, north = tile_bounds(z, x, y)
+        layer = self._road_layer()
+        self.router.expire_traffic()
+        if layer is None:
+            return {"type": "FeatureCollection", "features": self._observation_points(west, south, east, north)}
+        return {"type": "FeatureCollection", "features": self._road_features(layer, z, west, south, east, north,
+                                                                             congestion)}
+
+    def _road_features(self, layer: RoadLayer, z: int, west: float, south: float, east: float, north: float,
+                       congestion: float) -> List[Dict]:
+        graph = layer.graph
+        selected = ((layer.mid_lon >= west) & (layer.mid_lon < east)
+                    & (layer.mid_lat >= south) & (layer.mid_lat < north))
+        if z < ALL_ROADS_ZOOM:
+            selected &= layer.speeds >= MIN_SPEED_BY_ZOOM.get(z, max(MIN_SPEED_BY_ZOOM.values()))
+        picked = np.flatnonzero(selected)
+        if len(picked) == 0:
+            return []
+
+        edges = layer.edges[picked]
+        observed = graph.traffic_observed_at[edges] > 0
+        observed_ratio = graph.free_flow_car[edges] / graph.weights["car"][edges]
+        simulated_congestion = np.clip(congestion + layer.jitter[picked], 0.0, 1.0)
+        simulated_ratio = 1.0 - simulated_congestion * 0.8
+        ratios = np.where(observed, observed_ratio, simulated_ratio)
+
+        sources, targets = graph.sources[edges], graph.targets[edges]
+        lines = np.stack([
+            np.round(graph.lon[sources], COORDINATE_DECIMALS), np.round(graph.lat[sources], COORDINATE_DECIMALS),
+            np.round(graph.lon[targets], COORDINATE_DECIMALS), np.round(graph.lat[targets], COORDINATE_DECIMALS),
+        ], axis=1).tolist()
+
+        groups: Dict[Tuple[str, str], List] = {}
+        for line, ratio, is_observed in zip(lines, ratios.tolist(), observed.tolist()):
+            group = (get_traffic_color(ratio), "observed" if is_observed else "simulation")
+            groups.setdefault(group, []).append([line[:2], line[2:]])
+
+        return [
+            {
+                "type": "Feature",
+                "geometry": {"type": "MultiLineString", "coordinates": segments},
+                "properties": {"color": color, "source": source, "segments": len(segments)},
+            }
+            for (color, source), segments in sorted(groups.items())
+        ]
+
+    def _observation_points(self, west: float, south: float, east: float, north: float) -> List[Dict]:
+        """Without a road graph the overlay falls back to the observed cells themselves."""
+        features = []
+        for (lat, lon), age, observation in self.cache.snapshot(self.cache.history_ttl):
+            if not (west <= lon < east and south <= lat < north):
+                continue
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {
+                    "color": get_traffic_color(observation["speedRatio"]),
+                    "source": "observed",
+                    "speedRatio": round(observation["speedRatio"], 3),
+                    "observationAge": round(age, 1),
+                },
+            })
+        return features
+
+
+traffic_tiles = TrafficTiles(router, observation_cache)
+router.add_listener(traffic_tiles.mark_dirty)
+observation_cache.add_listener(traffic_tiles.mark_observed_cell)
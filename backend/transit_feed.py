@@ -0,0 +1,291 @@
+import importlib
+import importlib.util
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+import metrics
+import shape_simplify
+from stop_index import StopIndex
+
+
+def encode_json(payload) -> bytes:
+    """Serialize a payload the same way FastAPI's JSONResponse does."""
+    return json.dumps(
+        jsonable_encoder(payload),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class ShapeNotSupported(ValueError):
+    """Raised when a route shape cannot be simplified or encoded as a polyline."""
+
+
+class FeedVersion:
+    """
+    One immutable, fully loaded GTFS dataset.
+
+    Requests lease a version for their whole duration, so a reload never
+    changes the data under a request that is already running.
+    """
+
+    def __init__(self, number: int, service):
+        self.number = number
+        self.service = service
+        self.built_at = datetime.now()
+        self.version = f"{number}-{self.built_at.strftime('%Y%m%d%H%M%S')}"
+        self.etag = f'W/"gtfs-{self.version}"'
+        self.active_requests = 0
+        self.retired = False
+        self._artifacts: Dict = {}
+        self._artifacts_lock = threading.Lock()
+
+    def artifact(self, name: str, builder: Callable):
+        """Build a derived structure once per version and reuse it."""
+        cache = "transit_" + name.split(":", 1)[0]
+        value = self._artifacts.get(name)
+        if value is None:
+            with self._artifacts_lock:
+                value = self._artifacts.get(name)
+                if value is None:
+                    metrics.record_cache(cache, hit=False)
+                    value = builder()
+                    self._artifacts[name] = value
+                    return value
+        metrics.record_cache(cache, hit=True)
+        return value
+
+    def stop_index(self) -> StopIndex:
+        return self.artifact("stop_index", lambda: StopIndex(self.service.get_all_stops()))
+
+    def stops_json(self) -> bytes:
+        def build():
+            stops = self.service.get_all_stops()
+            return encode_json({"stops": stops, "count": len(stops)})
+        return self.artifact("stops_json", build)
+
+    def routes_json(self) -> bytes:
+        def build():
+            routes = self.service.get_all_routes()
+            return encode_json({"routes": routes, "count": len(routes)})
+        return self.artifact("routes_json", build)
+
+    def _build_route_shapes(self) -> Dict:
+        shapes = {}
+        for route in self.service.get_all_routes():
+            route_id = route.get("route_id")
+            if route_id is None:
+                continue
+            shape = self.service.get_route_shape(str(route_id))
+            if not shape:
+                continue
+            key = shape_simplify.shape_key(shape)
+            levels = shape_simplify.build_levels(shape[key]) if key else None
+            shapes[str(route_id)] = {"shape": shape, "key": key, "levels": levels}
+        return shapes
+
+    def route_shapes(self) -> Dict:
+        """Route shapes with their geometry simplified at every tolerance level."""
+        return self.artifact("route_shapes", self._build_route_shapes)
+
+    def route_shape_json(self, route_id: str, tolerance: float = 0.0,
+                         encoding: str = "json") -> Optional[Tuple[bytes, float]]:
+        """
+        Pre-encoded shape response for a route at the closest precomputed level.
+
+        Returns:
+            (body, tolerance level actually used), or None if the route has no shape
+
+        Raises:
+            ShapeNotSupported: if simplification or polyline encoding was requested
+                but the shape has no recognizable point list
+        """
+        entry = self.route_shapes().get(route_id)
+        if entry is None:
+            shape = self.service.get_route_shape(route_id)
+            if not shape:
+                return None
+            key = shape_simplify.shape_key(shape)
+            entry = {"shape": shape, "key": key, "levels": shape_simplify.build_levels(shape[key]) if key else None}
+
+        level = shape_simplify.pick_level(tolerance)
+        if entry["key"] is None and (level > 0 or encoding == "polyline"):
+            raise ShapeNotSupported(
+                f"Route {route_id} shape has no point list under {', '.join(shape_simplify.SHAPE_KEYS)}"
+            )
+
+        def build():
+            payload = dict(entry["shape"])
+            key = entry["key"]
+            if key:
+                points = entry["levels"][level]
+                payload[key] = shape_simplify.encode_polyline(points) if encoding == "polyline" else points
+                payload["encoding"] = encoding
+                payload["tolerance"] = level
+                payload["pointCount"] = len(points)
+            return encode_json(payload)
+
+        return self.artifact(f"shape:{route_id}:{level}:{encoding}", build), level
+
+    def prepare(self):
+        """Warm the derived structures before the version starts serving."""
+        for build in (self.stop_index, self.stops_json, self.routes_json, self.route_shapes):
+            try:
+                build()
+            except Exception as e:
+                print(f"Error preparing GTFS feed version {self.version}: {e}")
+
+    def release(self):
+        """Drop the dataset so it can be garbage collected."""
+        close = getattr(self.service, "close", None)
+        if callable(close):
+            close()
+        self.service = None
+        self._artifacts = {}
+
+
+def load_gtfs_service():
+    """
+    Build a fresh GTFS dataset.
+
+    `gtfs_service` loads its data when the module is executed, so a private
+    copy of the module is executed to pick up new timetable files. The shared
+    module is never re-executed: its globals, used by the previous instance
+    under requests still holding it, stay untouched.
+    """
+    spec = importlib.util.find_spec("gtfs_service")
+    if spec is None:
+        raise ModuleNotFoundError("No module named 'gtfs_service'", name="gtfs_service")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.gtfs_service
+
+
+class FeedNotReady(RuntimeError):
+    """Raised when a request needs the GTFS feed before its first version is loaded."""
+
+
+class TransitFeed:
+    """
+    Double-buffered holder for the GTFS dataset.
+
+    A new dataset is built in a background thread and swapped in atomically.
+    The previous version is released once its last request finishes.
+    """
+
+    def __init__(self, loader: Callable = load_gtfs_service):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._initial_load_lock = threading.Lock()
+        self._current: Optional[FeedVersion] = None
+        self._counter = 0
+        self._reload_thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def current(self) -> Optional[FeedVersion]:
+        return self._current
+
+    def _build(self) -> FeedVersion:
+        service = self._loader()
+        with self._lock:
+            self._counter += 1
+            number = self._counter
+        feed_version = FeedVersion(number, service)
+        feed_version.prepare()
+        return feed_version
+
+    def _swap(self, new_version: FeedVersion):
+        with self._lock:
+            old_version = self._current
+            self._current = new_version
+            if old_version is not None:
+                old_version.retired = True
+                if old_version.active_requests == 0:
+                    old_version.release()
+        print(f"GTFS feed version {new_version.version} is now active")
+
+    def load(self) -> FeedVersion:
+        """Build a new version in the calling thread and make it active."""
+        new_version = self._build()
+        self._swap(new_version)
+        return new_version
+
+    def ensure_loaded(self) -> FeedVersion:
+        """
+        Load the first version unless one is already active.
+
+        Concurrent callers wait for the same load instead of building the feed twice.
+        """
+        with self._initial_load_lock:
+            if self._current is None:
+                self.load()
+            return self._current
+
+    def _reload_worker(self):
+        try:
+            self.load()
+            self.last_error = None
+        except Exception as e:
+            print(f"Error reloading GTFS feed: {e}")
+            self.last_error = str(e)
+
+    def reload_in_background(self) -> bool:
+        """
+        Start building a new version without blocking requests.
+
+        Returns:
+            False if a reload is already in progress, True otherwise
+        """
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self._reload_thread = threading.Thread(
+                target=self._reload_worker, name="gtfs-reload", daemon=True
+            )
+            self._reload_thread.start()
+        return True
+
+    def is_reloading(self) -> bool:
+        thread = self._reload_thread
+        return thread is not None and thread.is_alive()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Lease the active version for the duration of a request.
+
+        Raises:
+            FeedNotReady: if no version has been loaded yet (see ensure_loaded)
+        """
+        with self._lock:
+            feed_version = self._current
+            if feed_version is None:
+                raise FeedNotReady("GTFS feed is not loaded yet")
+            feed_version.active_requests += 1
+        try:
+            yield feed_version
+        finally:
+            with self._lock:
+                feed_version.active_requests -= 1
+                if feed_version.retired and feed_version.active_requests == 0:
+                    feed_version.release()
+
+    def status(self) -> Dict:
+        current = self._current
+        return {
+            "version": current.version if current else None,
+            "built_at": current.built_at if current else None,
+            "reloading": self.is_reloading(),
+            "last_error": self.last_error,
+        }
+
+
+transit_feed = TransitFeed()